@@ -1,57 +1,42 @@
 import os
-from PyPDF2 import PdfReader
+from rag_app.chunking import ChunkStats
+from rag_app.extraction import iter_pdf_chunks
 from PyPDF2.errors import PdfReadError
 
 BASE_FOLDER = r"D:/Assesment/Data"
 
 
-def extract_text_from_pdf(file_path):
-    try:
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-        return text
-    except PdfReadError as e:
-        print(f"Skipping corrupted PDF '{file_path}': {e}")
-        return ""
-    except Exception as ex:
-        print(f"Unexpected error with '{file_path}': {ex}")
-        return ""
-
-
-def chunk_text(text, chunk_size=500):
-    paragraphs = text.split("\n\n")
-    chunks = []
-    current_chunk = ""
-    for para in paragraphs:
-        if len(current_chunk) + len(para) < chunk_size:
-            current_chunk += para + "\n\n"
-        else:
-            chunks.append(current_chunk.strip())
-            current_chunk = para + "\n\n"
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    return chunks
-
-
 def main():
+    stats = ChunkStats()
     for root, dirs, files in os.walk(BASE_FOLDER):
         for filename in files:
             if filename.lower().endswith(".pdf"):
                 file_path = os.path.join(root, filename)
                 print(f"\nProcessing document: {file_path}")
-                text = extract_text_from_pdf(file_path)
-                if not text:
+                # Chunks are streamed page by page; only the first 3 are kept
+                samples = []
+                num_chunks = 0
+                try:
+                    for page, chunk in iter_pdf_chunks(file_path, stats=stats):
+                        if len(samples) < 3:
+                            samples.append((page, chunk))
+                        num_chunks += 1
+                except PdfReadError as e:
+                    print(f"Skipping corrupted PDF '{file_path}': {e}")
+                    continue
+                except Exception as ex:
+                    print(f"Unexpected error with '{file_path}': {ex}")
+                    continue
+                if not num_chunks:
                     print("No text extracted; skipping.")
                     continue
-                chunks = chunk_text(text)
-                print(f"Extracted {len(chunks)} chunks")
-                for i, chunk in enumerate(chunks[:3]):  # Show first 3 chunks sample
-                    print(f"\n--- Chunk {i + 1} ---")
+                print(f"Extracted {num_chunks} chunks")
+                # Show first 3 chunks sample
+                for i, (page, chunk) in enumerate(samples):
+                    print(f"\n--- Chunk {i + 1} (page {page}) ---")
                     print(chunk)
+    print("\nChunk statistics:")
+    print("\n".join(stats.report()))
 
 
 if __name__ == "__main__":
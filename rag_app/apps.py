@@ -1,6 +1,31 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+# Set to "1" by rag_project/wsgi.py and asgi.py before Django starts. Anything
+# else that sets Django up (management commands, scripts, workers, tests) does
+# not warm up.
+SERVER_PROCESS_ENV = "RAG_SERVER_PROCESS"
+
+
+def _is_server_process():
+    """True for WSGI/ASGI servers and the serving `runserver` process only."""
+    if os.environ.get(SERVER_PROCESS_ENV) == "1":
+        return True
+    if len(sys.argv) < 2 or sys.argv[1] != "runserver":
+        return False
+    # With the autoreloader, only the child process started with RUN_MAIN serves
+    return "--noreload" in sys.argv or os.environ.get("RUN_MAIN") == "true"
 
 
 class RagAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "rag_app"
+
+    def ready(self):
+        if getattr(settings, "RAG_EAGER_WARMUP", True) and _is_server_process():
+            from rag_app import resources
+
+            resources.start_warm_up()
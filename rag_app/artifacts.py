@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from django.db.models import Count, Max, Min
+
+from rag_app.bm25 import BM25Index
+from rag_app.chunk_store import ChunkStore
+from rag_app.models import Chunk, Document
+
+# Bump whenever the on-disk layout of the artifacts changes
+ARTIFACT_FORMAT_VERSION = 2
+MANIFEST_NAME = "manifest.json"
+
+# Row-aligned arrays, opened with np.load(mmap_mode="r") so that every worker
+# process shares the same physical pages.
+ARRAY_FILES = {
+    "chunk_ids": "chunk_ids.npy",
+    "doc_index": "chunk_doc_index.npy",
+    "chunk_order": "chunk_order.npy",
+    "page_numbers": "chunk_page_numbers.npy",
+    "text_offsets": "chunk_text_offsets.npy",
+    "text_buffer": "chunk_texts.npy",
+    "bm25_indptr": "bm25_indptr.npy",
+    "bm25_indices": "bm25_indices.npy",
+    "bm25_term_freqs": "bm25_term_freqs.npy",
+    "bm25_doc_lengths": "bm25_doc_lengths.npy",
+}
+DOCUMENTS_FILE = "documents.json"
+TERMS_FILE = "bm25_terms.txt"
+
+
+class StaleArtifactsError(Exception):
+    """Raised when the artifacts on disk do not describe the current database."""
+
+
+def current_corpus_version():
+    """
+    A cheap fingerprint of the Chunk/Document tables; it changes on every (re)import.
+
+    Chunks are summarized by their ids. The metadata of every document is
+    hashed as well, since a relinked document keeps its id and chunks but
+    changes the titles and links shown in answers.
+    """
+    chunks = Chunk.objects.aggregate(count=Count("id"), low=Min("id"), high=Max("id"))
+    digest = hashlib.sha256(
+        f"chunks:{chunks['count']}:{chunks['low']}:{chunks['high']}".encode("utf-8")
+    )
+    documents = Document.objects.order_by("id").values_list(
+        "id", "title", "source_url", "file_path"
+    )
+    for document in documents.iterator():
+        digest.update(b"|" + json.dumps(document).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _replace_file(path, write):
+    """
+    Writes through a temporary file and renames it into place.
+
+    Running servers keep their existing memory maps of the old inode, so an
+    artifact is never modified underneath a worker that is reading it.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def write_artifacts(directory, chunk_store, bm25_index, corpus_version, extra=None):
+    """Saves the chunk store and BM25 index as versioned binary artifacts plus a manifest."""
+    os.makedirs(directory, exist_ok=True)
+
+    arrays = {
+        "chunk_ids": np.asarray(chunk_store.ids, dtype=np.int64),
+        "doc_index": np.asarray(chunk_store.doc_index, dtype=np.int32),
+        "chunk_order": np.asarray(chunk_store.chunk_order, dtype=np.int32),
+        "page_numbers": np.asarray(chunk_store.page_numbers, dtype=np.int32),
+        "text_offsets": np.asarray(chunk_store.offsets, dtype=np.int64),
+        "text_buffer": np.frombuffer(bytes(chunk_store.text_buffer), dtype=np.uint8),
+        "bm25_indptr": np.asarray(bm25_index.indptr, dtype=np.int64),
+        "bm25_indices": np.asarray(bm25_index.indices, dtype=np.int32),
+        "bm25_term_freqs": np.asarray(bm25_index.term_freqs, dtype=np.float32),
+        "bm25_doc_lengths": np.asarray(bm25_index.doc_lengths, dtype=np.float32),
+    }
+    for name, array in arrays.items():
+        _replace_file(
+            os.path.join(directory, ARRAY_FILES[name]),
+            lambda f, array=array: np.save(f, array),
+        )
+
+    documents = json.dumps(chunk_store.documents).encode("utf-8")
+    _replace_file(os.path.join(directory, DOCUMENTS_FILE), lambda f: f.write(documents))
+
+    terms = sorted(bm25_index.vocabulary, key=bm25_index.vocabulary.get)
+    terms_blob = "\n".join(terms).encode("utf-8")
+    _replace_file(os.path.join(directory, TERMS_FILE), lambda f: f.write(terms_blob))
+
+    files = {}
+    for filename in [*ARRAY_FILES.values(), DOCUMENTS_FILE, TERMS_FILE]:
+        path = os.path.join(directory, filename)
+        files[filename] = {
+            "bytes": os.path.getsize(path),
+            "sha256": file_sha256(path),
+        }
+
+    manifest = {
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "corpus_version": corpus_version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "num_rows": len(chunk_store),
+        "bm25": {
+            "k1": bm25_index.k1,
+            "b": bm25_index.b,
+            "use_stemming": bm25_index.use_stemming,
+        },
+        "files": files,
+        **(extra or {}),
+    }
+    # The manifest is written last so that it only ever describes complete artifacts
+    manifest_blob = json.dumps(manifest, indent=2).encode("utf-8")
+    _replace_file(
+        os.path.join(directory, MANIFEST_NAME), lambda f: f.write(manifest_blob)
+    )
+    return manifest
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME), "r") as f:
+        return json.load(f)
+
+
+class SearchArtifacts:
+    """The memory-mapped chunk store and BM25 index described by one manifest."""
+
+    def __init__(self, manifest, chunk_store, bm25_index):
+        self.manifest = manifest
+        self.chunk_store = chunk_store
+        self.bm25_index = bm25_index
+
+    @property
+    def corpus_version(self):
+        return self.manifest["corpus_version"]
+
+    @property
+    def num_rows(self):
+        return self.manifest["num_rows"]
+
+
+def load_artifacts(directory, verify_checksums=True, expected_corpus_version=None):
+    """
+    Opens the artifacts written by `embed_chunks`.
+
+    Raises FileNotFoundError when they were never built, and StaleArtifactsError
+    when they are from another format version, are damaged, or were built for a
+    different corpus than the one currently in the database.
+    """
+    manifest = read_manifest(directory)
+
+    if manifest.get("format_version") != ARTIFACT_FORMAT_VERSION:
+        raise StaleArtifactsError(
+            f"artifact format {manifest.get('format_version')} is not supported "
+            f"(expected {ARTIFACT_FORMAT_VERSION})"
+        )
+
+    if expected_corpus_version is None:
+        expected_corpus_version = current_corpus_version()
+    if manifest["corpus_version"] != expected_corpus_version:
+        raise StaleArtifactsError(
+            f"artifacts were built for corpus {manifest['corpus_version']}, "
+            f"but the database is at {expected_corpus_version}"
+        )
+
+    for filename, meta in manifest["files"].items():
+        path = os.path.join(directory, filename)
+        if os.path.getsize(path) != meta["bytes"]:
+            raise StaleArtifactsError(f"{filename} has an unexpected size")
+        if verify_checksums and file_sha256(path) != meta["sha256"]:
+            raise StaleArtifactsError(f"{filename} failed its checksum")
+
+    arrays = {
+        name: np.load(os.path.join(directory, filename), mmap_mode="r")
+        for name, filename in ARRAY_FILES.items()
+    }
+    with open(os.path.join(directory, DOCUMENTS_FILE), "r", encoding="utf-8") as f:
+        documents = json.load(f)
+    with open(os.path.join(directory, TERMS_FILE), "r", encoding="utf-8") as f:
+        terms = f.read().split("\n") if os.path.getsize(f.name) else []
+
+    chunk_store = ChunkStore(
+        arrays["chunk_ids"],
+        arrays["doc_index"],
+        arrays["chunk_order"],
+        arrays["text_offsets"],
+        arrays["text_buffer"],
+        documents,
+        arrays["page_numbers"],
+    )
+    bm25_params = manifest["bm25"]
+    bm25_index = BM25Index(
+        {term: i for i, term in enumerate(terms)},
+        arrays["bm25_indptr"],
+        arrays["bm25_indices"],
+        arrays["bm25_term_freqs"],
+        arrays["bm25_doc_lengths"],
+        k1=bm25_params["k1"],
+        b=bm25_params["b"],
+        use_stemming=bm25_params["use_stemming"],
+    )
+    return SearchArtifacts(manifest, chunk_store, bm25_index)
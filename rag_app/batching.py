@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class _PendingSearch:
+    __slots__ = ("query", "k", "search_settings", "future", "enqueued_at")
+
+    def __init__(self, query, k, search_settings):
+        self.query = query
+        self.k = k
+        self.search_settings = search_settings
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-query searches into one encode and one FAISS search.
+
+    The first waiting query opens a batch window. Every query that arrives within
+    `max_wait_ms`, up to `max_batch_size` queries, joins the same batch. Each
+    caller gets back its own (distances, ids) row, truncated to the k it asked for.
+    Queries with different search settings (nprobe, efSearch) still share the
+    encode; search_batch groups them by settings.
+    """
+
+    def __init__(self, encode_batch, search_batch, max_batch_size=32, max_wait_ms=5):
+        # encode_batch(list of queries) -> (n, dim) float32 matrix
+        self.encode_batch = encode_batch
+        # search_batch(matrix, k, per-row search settings) -> (distances, ids)
+        self.search_batch = search_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+        # Metrics
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.batch_sizes = Counter()
+        self._recent_delays = deque(maxlen=1024)
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="rag-microbatch", daemon=True
+                )
+                self._worker.start()
+
+    def submit(self, query, k, search_settings=None):
+        """Queues a search and returns a Future of (distances, ids), each of shape (1, k)."""
+        self._ensure_worker()
+        pending = _PendingSearch(query, k, search_settings)
+        self._queue.put(pending)
+        return pending.future
+
+    def search(self, query, k, search_settings=None):
+        return self.submit(query, k, search_settings).result()
+
+    def _collect(self):
+        """Blocks for the first query, then gathers more until the window closes."""
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            self._record(batch, started)
+            try:
+                embeddings = self.encode_batch([pending.query for pending in batch])
+                k = max(pending.k for pending in batch)
+                distances, ids = self.search_batch(
+                    np.ascontiguousarray(embeddings, dtype=np.float32),
+                    k,
+                    [pending.search_settings for pending in batch],
+                )
+            except Exception as e:
+                for pending in batch:
+                    pending.future.set_exception(e)
+                continue
+            for i, pending in enumerate(batch):
+                pending.future.set_result(
+                    (distances[i : i + 1, : pending.k], ids[i : i + 1, : pending.k])
+                )
+
+    def _record(self, batch, started):
+        with self._stats_lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self._recent_delays.extend(
+                started - pending.enqueued_at for pending in batch
+            )
+
+    def stats(self):
+        with self._stats_lock:
+            delays_ms = np.array(self._recent_delays or [0.0]) * 1000.0
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "mean_batch_size": (
+                    round(self.requests / self.batches, 3) if self.batches else 0.0
+                ),
+                "batch_size_histogram": {
+                    str(size): count for size, count in sorted(self.batch_sizes.items())
+                },
+                "queue_delay_ms": {
+                    "mean": round(float(delays_ms.mean()), 3),
+                    "p95": round(float(np.percentile(delays_ms, 95)), 3),
+                    "max": round(float(delays_ms.max()), 3),
+                },
+            }
@@ -0,0 +1,189 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Suffixes removed by the light stemmer, longest first
+STEM_SUFFIXES = (
+    "ational",
+    "ization",
+    "fulness",
+    "ousness",
+    "iveness",
+    "ations",
+    "ation",
+    "ments",
+    "ment",
+    "ness",
+    "ings",
+    "ing",
+    "ies",
+    "ied",
+    "ed",
+    "es",
+    "ly",
+    "s",
+)
+
+
+def stem(token):
+    """A light suffix-stripping stemmer ("guards" -> "guard", "safeties" -> "safety")."""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    for suffix in STEM_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            if suffix == "s" and token.endswith(("ss", "us", "is")):
+                return token
+            if suffix in ("ies", "ied"):
+                return token[: -len(suffix)] + "y"
+            return token[: -len(suffix)]
+    return token
+
+
+def tokenize(text, use_stemming=False):
+    """Lowercases the text, strips punctuation and optionally stems each token."""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if use_stemming:
+        tokens = [stem(token) for token in tokens]
+    return tokens
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index stored as CSR-style NumPy arrays.
+
+    Postings for term `t` are `indices[indptr[t]:indptr[t + 1]]` (document rows,
+    ascending) with matching `term_freqs`. Queries only read the postings of their
+    own terms, so scoring cost follows the query's document frequencies rather
+    than the corpus size.
+    """
+
+    def __init__(
+        self,
+        vocabulary,
+        indptr,
+        indices,
+        term_freqs,
+        doc_lengths,
+        k1=1.5,
+        b=0.75,
+        use_stemming=False,
+    ):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.indices = indices
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.use_stemming = use_stemming
+
+        self.num_docs = len(doc_lengths)
+        # Guard against an all-empty corpus so length normalization never divides by 0
+        self.avgdl = float(doc_lengths.mean()) if self.num_docs else 0.0
+        self.avgdl = self.avgdl or 1.0
+        doc_freqs = np.diff(indptr).astype(np.float64)
+        self.idf = np.log(
+            1.0 + (self.num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)
+        ).astype(np.float32)
+
+    def __len__(self):
+        return self.num_docs
+
+    @classmethod
+    def build(cls, texts, k1=1.5, b=0.75, use_stemming=False):
+        """Builds the index from an iterable of texts; row i corresponds to the i-th text."""
+        vocabulary = {}
+        term_ids, doc_rows, freqs, doc_lengths = [], [], [], []
+
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text, use_stemming))
+            doc_lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_rows.append(row)
+                freqs.append(freq)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        # A stable sort keeps each term's postings in ascending row order
+        order = np.argsort(term_ids, kind="stable")
+
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=indptr[1:])
+
+        return cls(
+            vocabulary,
+            indptr,
+            np.asarray(doc_rows, dtype=np.int32)[order],
+            np.asarray(freqs, dtype=np.float32)[order],
+            np.asarray(doc_lengths, dtype=np.float32),
+            k1=k1,
+            b=b,
+            use_stemming=use_stemming,
+        )
+
+    def _query_terms(self, query):
+        """Maps a query string to (term id, query frequency) pairs for known terms."""
+        counts = Counter(tokenize(query, self.use_stemming))
+        return [
+            (self.vocabulary[term], count)
+            for term, count in counts.items()
+            if term in self.vocabulary
+        ]
+
+    def _term_weights(self, term_id, docs, freqs):
+        doc_lengths = self.doc_lengths[docs]
+        norm = self.k1 * (1.0 - self.b + self.b * doc_lengths / self.avgdl)
+        return self.idf[term_id] * freqs * (self.k1 + 1.0) / (freqs + norm)
+
+    def _postings(self, query):
+        """Returns the concatenated (doc rows, weighted contributions) of the query terms."""
+        docs, contributions = [], []
+        for term_id, count in self._query_terms(query):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            term_docs = np.asarray(self.indices[start:end])
+            term_freqs = np.asarray(self.term_freqs[start:end])
+            docs.append(term_docs)
+            contributions.append(
+                count * self._term_weights(term_id, term_docs, term_freqs)
+            )
+        if not docs:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        return np.concatenate(docs), np.concatenate(contributions)
+
+    def get_scores(self, query):
+        """Returns a dense score vector over every document."""
+        docs, contributions = self._postings(query)
+        return np.bincount(docs, weights=contributions, minlength=self.num_docs)
+
+    def get_batch_scores(self, query, rows):
+        """Scores only the given document rows, looking each up in the query's postings."""
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = np.zeros(len(rows), dtype=np.float64)
+        for term_id, count in self._query_terms(query):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            term_docs = np.asarray(self.indices[start:end])
+            positions = np.searchsorted(term_docs, rows)
+            positions[positions == len(term_docs)] = 0
+            hit = term_docs[positions] == rows
+            if not hit.any():
+                continue
+            freqs = np.asarray(self.term_freqs[start:end])[positions[hit]]
+            scores[hit] += count * self._term_weights(term_id, rows[hit], freqs)
+        return scores
+
+    def top_k(self, query, k):
+        """Returns the (rows, scores) of the k best-matching documents, best first."""
+        docs, contributions = self._postings(query)
+        if not len(docs):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        matched, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions)
+        if k < len(matched):
+            best = np.argpartition(-scores, k)[:k]
+        else:
+            best = np.arange(len(matched))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return matched[best].astype(np.int64), scores[best]
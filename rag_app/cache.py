@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Token rotated by import_pdfs and embed_chunks; part of every answer cache key
+ANSWER_CACHE_GENERATION_FILE = os.path.join("embeddings", "answer_cache_generation")
+
+
+def normalize_query(query):
+    """
+    Canonical form used for cache keys.
+
+    all-MiniLM-L6-v2 uses an uncased tokenizer, so case and surrounding or
+    repeated whitespace do not change the embedding.
+    """
+    return _WHITESPACE.sub(" ", query).strip().lower()
+
+
+class LocalLRUBackend:
+    """A thread-safe, size-bounded in-process LRU with an optional TTL in seconds."""
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoCacheBackend:
+    """
+    Stores entries in one of Django's configured caches, so a shared backend
+    (Redis, Memcached, database) lets every worker reuse the same entries.
+    Size-based eviction is left to the cache's own MAX_ENTRIES/culling.
+    """
+
+    def __init__(self, alias="default", ttl=None, prefix="rag"):
+        self.alias = alias
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def get(self, key):
+        return self.cache.get(self._key(key))
+
+    def set(self, key, value):
+        self.cache.set(self._key(key), value, timeout=self.ttl)
+
+    def __len__(self):
+        # Django's cache API cannot count entries
+        return -1
+
+
+def build_backend(config, prefix):
+    """Creates a backend from a settings dict such as RAG_QUERY_EMBEDDING_CACHE."""
+    backend = config.get("BACKEND", "local")
+    if backend == "local":
+        return LocalLRUBackend(
+            max_size=config.get("MAX_SIZE", 1024), ttl=config.get("TTL")
+        )
+    if backend == "django":
+        return DjangoCacheBackend(
+            alias=config.get("CACHE_ALIAS", "default"),
+            ttl=config.get("TTL"),
+            prefix=prefix,
+        )
+    raise ValueError(f"Unknown cache backend '{backend}'. Use 'local' or 'django'.")
+
+
+class CountingCache:
+    """Wraps a backend and counts lookups so the hit rate can be reported."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "size": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class QueryEmbeddingCache(CountingCache):
+    """Caches query embeddings keyed on the model name and the normalized query text."""
+
+    def __init__(self, model_name, backend):
+        super().__init__(backend)
+        self.model_name = model_name
+
+    def key(self, query):
+        raw = f"{self.model_name}\x00{normalize_query(query)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, query):
+        return self._lookup(self.key(query))
+
+    def set(self, query, embedding):
+        self.backend.set(self.key(query), embedding)
+
+
+class PairScoreCache(CountingCache):
+    """Caches cross-encoder scores keyed on the model name, the query and the chunk text."""
+
+    def __init__(self, model_name, backend):
+        super().__init__(backend)
+        self.model_name = model_name
+
+    def key(self, query, text):
+        raw = f"{self.model_name}\x00{query.strip()}\x00{text}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, query, text):
+        return self._lookup(self.key(query, text))
+
+    def set(self, query, text, score):
+        self.backend.set(self.key(query, text), score)
+
+
+def invalidate_answer_cache(generation_file=ANSWER_CACHE_GENERATION_FILE):
+    """
+    Makes every cached answer unreachable, in this and every other process.
+
+    Writes a fresh generation token; servers notice the new file on their next
+    lookup, so stale answers are never served and simply age out of the cache.
+    """
+    os.makedirs(os.path.dirname(generation_file) or ".", exist_ok=True)
+    tmp_path = f"{generation_file}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp_path, generation_file)
+
+
+class AnswerCache(CountingCache):
+    """
+    Caches final /ask payloads. Keys cover the request options, the prompt
+    template version, the corpus version and the current generation token.
+    """
+
+    def __init__(self, backend, generation_file=ANSWER_CACHE_GENERATION_FILE):
+        super().__init__(backend)
+        self.generation_file = generation_file
+        self._generation = ""
+        self._generation_mtime = None
+
+    def generation(self):
+        """The current generation token, re-read only when its file changes."""
+        try:
+            mtime = os.stat(self.generation_file).st_mtime_ns
+        except FileNotFoundError:
+            return ""
+        if mtime != self._generation_mtime:
+            with open(self.generation_file, "r") as f:
+                self._generation = f.read().strip()
+            self._generation_mtime = mtime
+        return self._generation
+
+    def key(self, query, options, prompt_version, corpus_version):
+        raw = json.dumps(
+            [
+                normalize_query(query),
+                options,
+                prompt_version,
+                corpus_version,
+                self.generation(),
+            ],
+            sort_keys=True,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        return self._lookup(key)
+
+    def set(self, key, payload):
+        self.backend.set(key, payload)
@@ -0,0 +1,154 @@
+import numpy as np
+from rag_app.models import Chunk
+
+
+class ChunkStore:
+    """
+    A compact, read-only view of every embedded chunk, row-aligned with the FAISS index.
+
+    Row `i` of every array describes the vector stored at FAISS position `i` (or,
+    for an index keyed by Chunk id, the chunk `rows_for_ids` maps to row `i`), so a
+    FAISS search result can be resolved with plain NumPy indexing instead of
+    scanning Chunk objects or touching the ORM on the request path.
+    """
+
+    def __init__(
+        self,
+        ids,
+        doc_index,
+        chunk_order,
+        offsets,
+        text_buffer,
+        documents,
+        page_numbers=None,
+    ):
+        # Chunk primary keys (-1 for rows whose chunk no longer exists in the DB)
+        self.ids = ids
+        # Position of each row's document in `documents`
+        self.doc_index = doc_index
+        self.chunk_order = chunk_order
+        # Byte offsets into `text_buffer`; row i spans offsets[i]:offsets[i + 1]
+        self.offsets = offsets
+        # UTF-8 encoded text of every chunk, concatenated into one shared buffer
+        self.text_buffer = text_buffer
+        # Interned document metadata, one entry per document
+        self.documents = documents
+        # PDF page where each chunk starts (0 when unknown)
+        self.page_numbers = (
+            page_numbers
+            if page_numbers is not None
+            else np.zeros(len(ids), dtype=np.int32)
+        )
+        # (sorted ids, row of each sorted id), built on first use by rows_for_ids
+        self._id_lookup = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_database(cls, row_chunk_ids):
+        """Builds the store for the given FAISS-row -> Chunk.id array in a single DB pass."""
+        row_chunk_ids = np.asarray(row_chunk_ids, dtype=np.int64)
+        row_of_chunk = {
+            int(chunk_id): row for row, chunk_id in enumerate(row_chunk_ids)
+        }
+
+        num_rows = len(row_chunk_ids)
+        ids = np.full(num_rows, -1, dtype=np.int64)
+        doc_index = np.full(num_rows, -1, dtype=np.int32)
+        chunk_order = np.zeros(num_rows, dtype=np.int32)
+        page_numbers = np.zeros(num_rows, dtype=np.int32)
+        encoded_texts = [b""] * num_rows
+
+        documents = []
+        document_positions = {}
+
+        rows = Chunk.objects.order_by("id").values_list(
+            "id",
+            "chunk_text",
+            "chunk_order",
+            "page_number",
+            "document_id",
+            "document__title",
+            "document__source_url",
+        )
+        for (
+            chunk_id,
+            text,
+            order,
+            page_number,
+            document_id,
+            title,
+            source_url,
+        ) in rows.iterator():
+            row = row_of_chunk.get(chunk_id)
+            if row is None:
+                # The chunk was added after the index was built; it has no vector.
+                continue
+
+            position = document_positions.get(document_id)
+            if position is None:
+                position = len(documents)
+                document_positions[document_id] = position
+                documents.append(
+                    {"id": document_id, "title": title, "link": source_url}
+                )
+
+            ids[row] = chunk_id
+            doc_index[row] = position
+            chunk_order[row] = order
+            page_numbers[row] = page_number or 0
+            encoded_texts[row] = text.encode("utf-8")
+
+        offsets = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded_texts], out=offsets[1:])
+        text_buffer = b"".join(encoded_texts)
+
+        return cls(
+            ids, doc_index, chunk_order, offsets, text_buffer, documents, page_numbers
+        )
+
+    def text(self, row):
+        """Returns the decoded text of a single row."""
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return bytes(self.text_buffer[start:end]).decode("utf-8")
+
+    def texts(self, rows):
+        return [self.text(row) for row in rows]
+
+    def rows_for_ids(self, chunk_ids):
+        """Maps Chunk ids (as returned by an ID-keyed FAISS index) to rows; -1 if absent."""
+        if self._id_lookup is None:
+            order = np.argsort(self.ids, kind="stable")
+            self._id_lookup = (np.asarray(self.ids)[order], order)
+        sorted_ids, order = self._id_lookup
+
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        positions = np.searchsorted(sorted_ids, chunk_ids).clip(max=len(sorted_ids) - 1)
+        found = (chunk_ids >= 0) & (sorted_ids[positions] == chunk_ids)
+        return np.where(found, order[positions], -1)
+
+    def valid_rows(self, faiss_ids):
+        """Drops FAISS padding (-1) and rows whose chunk was deleted, keeping order."""
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64)
+        in_range = (faiss_ids >= 0) & (faiss_ids < len(self.ids))
+        rows = faiss_ids[in_range]
+        keep = self.ids[rows] >= 0
+        return rows[keep], np.flatnonzero(in_range)[keep]
+
+    def gather(self, rows, scores, reranker_used):
+        """Builds the API context dicts for the given rows and their scores."""
+        documents = [self.documents[i] for i in self.doc_index[rows]]
+        return [
+            {
+                "text": self.text(row),
+                "score": float(score),
+                "link": document["link"],
+                "title": document["title"],
+                "page": int(page) or None,
+                "reranker_used": reranker_used,
+            }
+            for row, score, document, page in zip(
+                rows, scores, documents, self.page_numbers[rows]
+            )
+        ]
@@ -0,0 +1,245 @@
+import bisect
+import re
+from collections import Counter
+from functools import lru_cache
+
+# Like rag_app.extraction, this module must not import Django: it runs in the
+# import_pdfs worker processes and in the standalone pdf_extract.py script.
+
+STRATEGIES = ("paragraph", "sentence-window", "token-budget")
+
+DEFAULT_CONFIG = {
+    # paragraph: pack whole paragraphs; sentence-window: pack whole sentences;
+    # token-budget: fixed-size token windows that ignore text boundaries
+    "STRATEGY": "paragraph",
+    # Target chunk size, and the tokens repeated at the start of the next chunk
+    "CHUNK_TOKENS": 200,
+    "OVERLAP_TOKENS": 0,
+    # Hard cap: all-MiniLM-L6-v2 reads 256 tokens including [CLS] and [SEP]
+    "MAX_TOKENS": 254,
+    # Tokenizer used for counting; None approximates with words and punctuation
+    "TOKENIZER": "sentence-transformers/all-MiniLM-L6-v2",
+}
+
+HISTOGRAM_BUCKET = 32
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+class Tokenizer:
+    """Counts tokens and finds token boundaries, using the embedding model's tokenizer."""
+
+    def __init__(self, name=None):
+        self.name = name
+        self._tokenizer = None
+        if name:
+            try:
+                from transformers import AutoTokenizer
+
+                self._tokenizer = AutoTokenizer.from_pretrained(name)
+            except Exception as e:
+                print(
+                    f"Could not load tokenizer '{name}' ({e}); "
+                    "approximating tokens with words and punctuation."
+                )
+
+    def spans(self, text):
+        """(start, end) character offsets of every token of text."""
+        if self._tokenizer is not None:
+            encoding = self._tokenizer(
+                text,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                verbose=False,
+            )
+            return encoding["offset_mapping"]
+        return [match.span() for match in WORD_PATTERN.finditer(text)]
+
+    def count(self, text):
+        return len(self.spans(text))
+
+    def split(self, text, max_tokens, overlap=0):
+        """Cuts text at token boundaries into pieces of at most max_tokens tokens."""
+        spans = self.spans(text)
+        step = max(1, max_tokens - overlap)
+        for start in range(0, len(spans), step):
+            window = spans[start : start + max_tokens]
+            yield text[window[0][0] : window[-1][1]]
+            if start + max_tokens >= len(spans):
+                break
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(name):
+    """One tokenizer per process, shared by every document it chunks."""
+    return Tokenizer(name)
+
+
+class ChunkStats:
+    """Chunk count and token-length histogram, mergeable across worker processes."""
+
+    def __init__(self):
+        self.chunks = 0
+        self.tokens = 0
+        self.longest = 0
+        self.histogram = Counter()
+
+    def add(self, num_tokens):
+        self.chunks += 1
+        self.tokens += num_tokens
+        self.longest = max(self.longest, num_tokens)
+        self.histogram[num_tokens // HISTOGRAM_BUCKET * HISTOGRAM_BUCKET] += 1
+
+    def update(self, other):
+        self.chunks += other.chunks
+        self.tokens += other.tokens
+        self.longest = max(self.longest, other.longest)
+        self.histogram.update(other.histogram)
+
+    def report(self):
+        """Human-readable summary lines for management command output."""
+        if not self.chunks:
+            return ["No chunks."]
+        lines = [
+            f"{self.chunks} chunks, {self.tokens} tokens "
+            f"(mean {self.tokens / self.chunks:.1f}, max {self.longest} tokens per chunk)"
+        ]
+        widest = max(self.histogram.values())
+        for low in sorted(self.histogram):
+            count = self.histogram[low]
+            bar = "#" * max(1, round(40 * count / widest))
+            lines.append(
+                f"  {low:>4}-{low + HISTOGRAM_BUCKET - 1:<4} tokens: {count:>7} {bar}"
+            )
+        return lines
+
+
+class Chunker:
+    """
+    Turns (page number, paragraph) pairs into (page number, chunk) pairs.
+
+    Every chunk has at most MAX_TOKENS tokens. Paragraphs or sentences that are
+    longer on their own are split at token boundaries, and empty text is never
+    emitted. A chunk is attributed to the page where it starts.
+    """
+
+    def __init__(self, config=None):
+        config = {**DEFAULT_CONFIG, **(config or {})}
+        if config["STRATEGY"] not in STRATEGIES:
+            raise ValueError(
+                f"Unknown chunking strategy '{config['STRATEGY']}'. "
+                f"Use one of: {', '.join(STRATEGIES)}."
+            )
+        if config["MAX_TOKENS"] < 1 or config["CHUNK_TOKENS"] < 1:
+            raise ValueError("Chunk sizes must be at least one token.")
+        if config["OVERLAP_TOKENS"] < 0:
+            raise ValueError("The chunk overlap cannot be negative.")
+        self.strategy = config["STRATEGY"]
+        self.max_tokens = config["MAX_TOKENS"]
+        self.chunk_tokens = min(config["CHUNK_TOKENS"], self.max_tokens)
+        self.overlap_tokens = min(config["OVERLAP_TOKENS"], self.chunk_tokens - 1)
+        self.tokenizer = get_tokenizer(config["TOKENIZER"])
+
+    def fits(self, text):
+        """Whether text is short enough to be a single chunk."""
+        return self.tokenizer.count(text) <= self.max_tokens
+
+    def chunks(self, paragraphs, stats=None):
+        if self.strategy == "token-budget":
+            chunks = self._token_windows(paragraphs)
+        elif self.strategy == "sentence-window":
+            chunks = self._pack(self._units(paragraphs, sentences=True), " ")
+        else:
+            chunks = self._pack(self._units(paragraphs), "\n\n")
+        for page, chunk in chunks:
+            # Joining units can shift token boundaries slightly; enforce the cap
+            num_tokens = self.tokenizer.count(chunk)
+            pieces = (
+                [chunk]
+                if num_tokens <= self.max_tokens
+                else list(self.tokenizer.split(chunk, self.max_tokens))
+            )
+            for piece in pieces:
+                if stats is not None:
+                    stats.add(
+                        num_tokens if len(pieces) == 1 else self.tokenizer.count(piece)
+                    )
+                yield page, piece
+
+    def _units(self, paragraphs, sentences=False):
+        """Yields (page, text, tokens) units no longer than the hard cap."""
+        for page, paragraph in paragraphs:
+            parts = SENTENCE_BOUNDARY.split(paragraph) if sentences else [paragraph]
+            for part in parts:
+                part = part.strip()
+                if not part:
+                    continue
+                num_tokens = self.tokenizer.count(part)
+                if num_tokens <= self.max_tokens:
+                    yield page, part, num_tokens
+                    continue
+                for piece in self.tokenizer.split(part, self.chunk_tokens):
+                    yield page, piece, self.tokenizer.count(piece)
+
+    def _pack(self, units, separator):
+        """Packs whole units up to CHUNK_TOKENS, repeating trailing units as overlap."""
+        current, total, fresh = [], 0, False
+        for unit in units:
+            if current and fresh and total + unit[2] > self.chunk_tokens:
+                yield current[0][0], separator.join(text for _, text, _ in current)
+                # Carry the trailing units that fit in the overlap budget
+                carried, carried_total = [], 0
+                for previous in reversed(current):
+                    if carried_total + previous[2] > self.overlap_tokens:
+                        break
+                    carried.insert(0, previous)
+                    carried_total += previous[2]
+                current, total, fresh = carried, carried_total, False
+            while current and total + unit[2] > self.max_tokens:
+                total -= current.pop(0)[2]
+            current.append(unit)
+            total += unit[2]
+            fresh = True
+        if current and fresh:
+            yield current[0][0], separator.join(text for _, text, _ in current)
+
+    def _token_windows(self, paragraphs):
+        """Fixed windows of CHUNK_TOKENS tokens over the running text, with overlap."""
+        buffer = ""
+        # Offsets in buffer where each paragraph starts, and its page
+        starts, pages = [], []
+        carried = 0
+        step = self.chunk_tokens - self.overlap_tokens
+        for page, paragraph in paragraphs:
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if buffer:
+                buffer += "\n\n"
+            starts.append(len(buffer))
+            pages.append(page)
+            buffer += paragraph
+
+            spans = self.tokenizer.spans(buffer)
+            while len(spans) > self.chunk_tokens:
+                yield pages[0], buffer[spans[0][0] : spans[self.chunk_tokens - 1][1]]
+                # Keep the overlap and the rest of the buffer for the next window
+                cut = spans[step][0]
+                buffer = buffer[cut:]
+                keep = max(0, bisect.bisect_right(starts, cut) - 1)
+                starts = [max(0, start - cut) for start in starts[keep:]]
+                pages = pages[keep:]
+                spans = self.tokenizer.spans(buffer)
+                carried = self.overlap_tokens
+        if len(self.tokenizer.spans(buffer)) > carried:
+            yield pages[0], buffer.strip()
+
+
+@lru_cache(maxsize=8)
+def _cached_chunker(config_items):
+    return Chunker(dict(config_items))
+
+
+def get_chunker(config=None):
+    """A Chunker for the config, built once per process."""
+    return _cached_chunker(tuple(sorted({**DEFAULT_CONFIG, **(config or {})}.items())))
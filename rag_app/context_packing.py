@@ -0,0 +1,91 @@
+from rag_app.chunking import WORD_PATTERN, get_tokenizer
+
+DEFAULT_CONFIG = {
+    # Prompt tokens available for contexts. TinyLlama runs with num_ctx 2048,
+    # which must also hold the instructions, the question and the answer.
+    "TOKEN_BUDGET": 1000,
+    # Tokenizer used for counting, e.g. "TinyLlama/TinyLlama-1.1B-Chat-v1.0";
+    # None approximates with words and punctuation, which undercounts Llama
+    # tokens by roughly a third, so the budget above leaves headroom
+    "TOKENIZER": None,
+    # Chunks whose word sets overlap at least this much (Jaccard) are duplicates
+    "DEDUPE_THRESHOLD": 0.9,
+    # Join selected chunks that are consecutive in the same document
+    "MERGE_NEIGHBORS": True,
+}
+
+
+def _word_set(text):
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def _is_duplicate(words, selected_words, threshold):
+    for other in selected_words:
+        union = len(words | other)
+        if union and len(words & other) / union >= threshold:
+            return True
+    return False
+
+
+def pack_contexts(chunk_store, rows, scores, reranker_used, max_contexts, config=None):
+    """
+    Builds the LLM contexts from ranked chunk-store rows within a token budget.
+
+    Rows are taken best first, skipping near-duplicates of chunks already
+    taken and chunks that no longer fit, until `max_contexts` chunks or the
+    budget are reached. The best chunk is always included, cut to the budget
+    if it is longer. Taken chunks that are neighbours in the same document are
+    then merged into one context, placed at the rank of its best chunk.
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    tokenizer = get_tokenizer(config["TOKENIZER"])
+    budget = config["TOKEN_BUDGET"]
+
+    # (rank, row, score, text) of every chunk taken
+    taken, taken_words, used = [], [], 0
+    for rank, (row, score) in enumerate(zip(rows, scores)):
+        if len(taken) == max_contexts:
+            break
+        text = chunk_store.text(row)
+        words = _word_set(text)
+        if _is_duplicate(words, taken_words, config["DEDUPE_THRESHOLD"]):
+            continue
+        num_tokens = tokenizer.count(text)
+        if used + num_tokens > budget:
+            if taken:
+                continue
+            text = next(tokenizer.split(text, budget), text)
+            num_tokens = budget
+        taken.append((rank, row, score, text))
+        taken_words.append(words)
+        used += num_tokens
+
+    # Group consecutive chunks of the same document
+    groups = []
+    for item in sorted(
+        taken,
+        key=lambda item: (
+            chunk_store.doc_index[item[1]],
+            chunk_store.chunk_order[item[1]],
+        ),
+    ):
+        row = item[1]
+        previous = groups[-1][-1][1] if groups else None
+        if (
+            config["MERGE_NEIGHBORS"]
+            and previous is not None
+            and chunk_store.doc_index[row] == chunk_store.doc_index[previous]
+            and chunk_store.chunk_order[row] == chunk_store.chunk_order[previous] + 1
+        ):
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    groups.sort(key=lambda group: min(item[0] for item in group))
+
+    contexts = []
+    for group in groups:
+        best = min(group, key=lambda item: item[0])
+        context = chunk_store.gather([group[0][1]], [best[2]], reranker_used)[0]
+        context["text"] = "\n\n".join(item[3] for item in group)
+        contexts.append(context)
+    return contexts
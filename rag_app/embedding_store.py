@@ -0,0 +1,140 @@
+import json
+import os
+
+import numpy as np
+
+META_FILE = "store.json"
+VECTORS_FILE = "vectors.bin"
+HASHES_FILE = "hashes.bin"
+HASH_WIDTH = 20  # SHA-1 digests, as produced by vector_index.content_hashes
+
+
+class EmbeddingStore:
+    """
+    Content-addressed, append-only store of chunk embeddings for one model.
+
+    Vectors live in a flat binary matrix and their content hashes in a parallel
+    file, both memory-mapped. Because entries are keyed by the hash of the chunk
+    text rather than by Chunk.id, re-imports, re-chunking and database resets
+    reuse every vector whose text was embedded before.
+    """
+
+    def __init__(self, directory, model_name, dtype="float32"):
+        self.directory = directory
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.dimension = None
+        self._row_of_hash = {}
+
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if meta["model"] != model_name:
+                raise ValueError(
+                    f"{directory} holds embeddings of {meta['model']}, not {model_name}"
+                )
+            # The existing files decide the layout; the requested dtype only
+            # applies to a new store
+            self.dtype = np.dtype(meta["dtype"])
+            self.dimension = meta["dimension"]
+            self._row_of_hash = {
+                bytes(content_hash): row
+                for row, content_hash in enumerate(self._hashes())
+            }
+
+    def __len__(self):
+        return len(self._row_of_hash)
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _hashes(self):
+        """Hashes of every complete row; a torn append past the vectors is ignored."""
+        path = self._path(HASHES_FILE)
+        if not os.path.getsize(path):
+            return np.empty(0, dtype=f"S{HASH_WIDTH}")
+        row_bytes = self.dimension * self.dtype.itemsize
+        num_rows = min(
+            os.path.getsize(path) // HASH_WIDTH,
+            os.path.getsize(self._path(VECTORS_FILE)) // row_bytes,
+        )
+        return np.memmap(path, dtype=f"S{HASH_WIDTH}", mode="r", shape=(num_rows,))
+
+    def _vectors(self):
+        return np.memmap(
+            self._path(VECTORS_FILE),
+            dtype=self.dtype,
+            mode="r",
+            shape=(len(self), self.dimension),
+        )
+
+    def lookup(self, hashes):
+        """Returns the store row of each hash, or -1 where it is not stored."""
+        return np.array(
+            [self._row_of_hash.get(bytes(h), -1) for h in hashes], dtype=np.int64
+        )
+
+    def vectors(self, rows):
+        """Returns the stored vectors of `rows` as a float32 matrix."""
+        if len(rows) == 0:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+        return np.asarray(self._vectors()[rows], dtype=np.float32)
+
+    def append(self, hashes, embeddings):
+        """Adds new (hash, vector) pairs; hashes that are already stored are skipped."""
+        embeddings = np.asarray(embeddings)
+        if self.dimension is None:
+            self.dimension = int(embeddings.shape[1])
+            os.makedirs(self.directory, exist_ok=True)
+            meta = {
+                "model": self.model_name,
+                "dimension": self.dimension,
+                "dtype": self.dtype.name,
+            }
+            with open(self._path(META_FILE), "w") as f:
+                json.dump(meta, f)
+            open(self._path(VECTORS_FILE), "wb").close()
+            open(self._path(HASHES_FILE), "wb").close()
+
+        num_rows = len(self._row_of_hash)
+        new_rows = []
+        for i, content_hash in enumerate(hashes):
+            content_hash = bytes(content_hash)
+            if content_hash not in self._row_of_hash:
+                self._row_of_hash[content_hash] = num_rows + len(new_rows)
+                new_rows.append(i)
+        if not new_rows:
+            return
+
+        # Vectors are written before their hashes, and a torn tail from an
+        # interrupted append is cut off first, so every hash points at a full vector
+        with open(self._path(VECTORS_FILE), "r+b") as f:
+            f.truncate(num_rows * self.dimension * self.dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(embeddings[new_rows], dtype=self.dtype))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._path(HASHES_FILE), "r+b") as f:
+            f.truncate(num_rows * HASH_WIDTH)
+            f.seek(0, os.SEEK_END)
+            f.write(np.asarray([hashes[i] for i in new_rows], dtype=f"S{HASH_WIDTH}"))
+
+    def embed(self, texts, hashes, encode):
+        """
+        Returns float32 embeddings of `texts`, encoding only texts not yet stored.
+
+        Returns (embeddings, number of texts that were encoded).
+        """
+        rows = self.lookup(hashes)
+        missing = np.flatnonzero(rows < 0)
+        # Identical texts inside one call are encoded once
+        first_of_hash = {}
+        for i in missing:
+            first_of_hash.setdefault(bytes(hashes[i]), i)
+        to_encode = list(first_of_hash.values())
+        if to_encode:
+            encoded = encode([texts[i] for i in to_encode])
+            self.append([hashes[i] for i in to_encode], encoded)
+            rows = self.lookup(hashes)
+        return self.vectors(rows), len(to_encode)
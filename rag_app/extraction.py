@@ -0,0 +1,155 @@
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from PyPDF2 import PdfReader
+from PyPDF2.errors import PdfReadError
+
+from rag_app.chunking import ChunkStats, get_chunker
+
+# This module must not import Django models: import_pdfs runs process_pdf in
+# worker processes, which import it without setting up Django.
+
+
+class ExtractionTimeout(Exception):
+    """Raised when a PDF takes longer than its time limit to extract."""
+
+
+@contextmanager
+def _time_limit(seconds):
+    """
+    Interrupts the block with ExtractionTimeout after `seconds`.
+
+    Uses SIGALRM where available (POSIX, main thread). Elsewhere the page loop
+    in extract_text_from_pdf still checks the deadline between pages.
+    """
+    if not seconds or not hasattr(signal, "setitimer"):
+        yield
+        return
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _raise_timeout(signum, frame):
+        raise ExtractionTimeout(f"timed out after {seconds}s")
+
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def iter_pages(file_path, timeout=None):
+    """Yields (page number, text) for every page of a PDF, numbered from 1."""
+    deadline = time.monotonic() + timeout if timeout else None
+    reader = PdfReader(file_path)
+    for number, page in enumerate(reader.pages, start=1):
+        if deadline is not None and time.monotonic() > deadline:
+            raise ExtractionTimeout(f"timed out after {timeout}s")
+        yield number, page.extract_text() or ""
+
+
+def iter_paragraphs(pages, fits=None):
+    """
+    Yields (page number, paragraph) from (page number, text) pairs.
+
+    Paragraphs end at blank lines. A paragraph that runs over a page break is
+    joined with a single newline and attributed to the page where it starts,
+    but only while `fits(text)` says it is short enough to end up in one chunk.
+    Otherwise, and when `fits` is None, each page yields its own piece of the
+    paragraph, so every chunk keeps the page it comes from and at most one page
+    of text is carried, even for PDFs without blank lines.
+    """
+    pending, pending_page = "", None
+    for number, text in pages:
+        if not text:
+            continue
+        parts = text.split("\n\n")
+        first_page = number
+        if pending:
+            joined = pending + "\n" + parts[0]
+            if fits is not None and fits(joined):
+                parts[0], first_page = joined, pending_page
+            else:
+                yield pending_page, pending
+        for i, part in enumerate(parts[:-1]):
+            yield (first_page if i == 0 else number), part
+        pending = parts[-1]
+        pending_page = first_page if len(parts) == 1 else number
+    if pending:
+        yield pending_page, pending
+
+
+def iter_pdf_chunks(file_path, timeout=None, chunking=None, stats=None):
+    """
+    Streams (page number, chunk) pairs of a PDF, holding about one page in memory.
+
+    `chunking` is a rag_app.chunking config dict; `stats` an optional ChunkStats.
+    """
+    chunker = get_chunker(chunking)
+    paragraphs = iter_paragraphs(iter_pages(file_path, timeout), chunker.fits)
+    return chunker.chunks(paragraphs, stats)
+
+
+def process_pdf(file_path, timeout=None, chunking=None):
+    """
+    Extracts and chunks one PDF; the unit of work of the import_pdfs process pool.
+
+    Chunks are streamed to a temporary JSON-lines spool file, one [page, text]
+    pair per line, so neither this process nor the importer holds a whole
+    document in memory. Never raises: failures are returned in "error" so that
+    one bad file does not abort the import.
+    """
+    started = time.perf_counter()
+    result = {
+        "file_path": file_path,
+        "spool": None,
+        "chunks": 0,
+        "pages": 0,
+        "stats": ChunkStats(),
+        "error": None,
+    }
+
+    def counted(pages):
+        for number, text in pages:
+            result["pages"] = number
+            yield number, text
+
+    fd, spool = tempfile.mkstemp(prefix="import_pdfs-", suffix=".jsonl")
+    try:
+        with _time_limit(timeout), open(fd, "w", encoding="utf-8") as f:
+            pages = counted(iter_pages(file_path, timeout=timeout))
+            chunker = get_chunker(chunking)
+            chunks = chunker.chunks(
+                iter_paragraphs(pages, chunker.fits), result["stats"]
+            )
+            for page, chunk in chunks:
+                f.write(json.dumps([page, chunk]) + "\n")
+                result["chunks"] += 1
+        result["spool"] = spool
+    except PdfReadError as e:
+        result["error"] = f"Skipping corrupted PDF '{file_path}': {e}"
+    except ExtractionTimeout as e:
+        result["error"] = f"Skipping PDF '{file_path}': extraction {e}"
+    except Exception as ex:
+        result["error"] = f"Unexpected error with '{file_path}': {ex}"
+    finally:
+        if result["spool"] is None:
+            os.remove(spool)
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def read_spool(spool):
+    """Yields the (page number, chunk) pairs written by process_pdf."""
+    with open(spool, "r", encoding="utf-8") as f:
+        for line in f:
+            page, chunk = json.loads(line)
+            yield page, chunk
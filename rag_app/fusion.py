@@ -0,0 +1,95 @@
+import math
+
+import numpy as np
+
+# Supported ways of putting semantic and keyword scores on a common scale
+FUSION_METHODS = ("minmax", "zscore", "rrf")
+DEFAULT_FUSION = "minmax"
+DEFAULT_WEIGHTS = {"semantic": 0.5, "lexical": 0.5}
+
+# Standard damping constant for reciprocal-rank fusion
+RRF_K = 60
+
+
+def minmax_normalize(scores):
+    """Scales scores to [0, 1]; a constant score vector carries no signal and maps to 0."""
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.size == 0:
+        return scores
+    spread = scores.max() - scores.min()
+    if spread == 0:
+        return np.zeros_like(scores)
+    return (scores - scores.min()) / spread
+
+
+def zscore_normalize(scores):
+    """Centers scores on 0 with unit variance; a constant score vector maps to 0."""
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.size == 0:
+        return scores
+    std = scores.std()
+    if std == 0:
+        return np.zeros_like(scores)
+    return (scores - scores.mean()) / std
+
+
+def reciprocal_rank(scores, rrf_k=RRF_K):
+    """Replaces scores by 1 / (rrf_k + rank), where rank 1 is the highest score."""
+    scores = np.asarray(scores, dtype=np.float64)
+    ranks = np.empty(scores.size, dtype=np.float64)
+    ranks[np.argsort(-scores, kind="stable")] = np.arange(1, scores.size + 1)
+    return 1.0 / (rrf_k + ranks)
+
+
+NORMALIZERS = {
+    "minmax": minmax_normalize,
+    "zscore": zscore_normalize,
+    "rrf": reciprocal_rank,
+}
+
+
+def fuse_scores(
+    semantic_distances, lexical_scores, method=DEFAULT_FUSION, weights=None
+):
+    """
+    Blends FAISS L2 distances and BM25 scores for the same candidate set.
+
+    Distances are negated first so that, like BM25, a larger value means a better
+    match. Both signals are then normalized with `method` and combined with the
+    given weights. Returns one fused score per candidate (higher is better).
+    """
+    if method not in NORMALIZERS:
+        raise ValueError(
+            f"Unknown fusion method '{method}'. Use one of: {', '.join(FUSION_METHODS)}."
+        )
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+
+    normalize = NORMALIZERS[method]
+    semantic = normalize(-np.asarray(semantic_distances, dtype=np.float64))
+    lexical = normalize(lexical_scores)
+    return weights["semantic"] * semantic + weights["lexical"] * lexical
+
+
+def parse_fusion_options(data):
+    """Reads the optional `fusion` and `weights` fields of an /ask request body."""
+    method = data.get("fusion", DEFAULT_FUSION)
+    if method not in NORMALIZERS:
+        raise ValueError(
+            f"Invalid fusion '{method}'. Use one of: {', '.join(FUSION_METHODS)}."
+        )
+
+    raw_weights = data.get("weights") or {}
+    if not isinstance(raw_weights, dict):
+        raise ValueError("'weights' must be an object with 'semantic' and 'lexical'.")
+    weights = dict(DEFAULT_WEIGHTS)
+    for name, value in raw_weights.items():
+        if name not in DEFAULT_WEIGHTS:
+            raise ValueError(f"Unknown weight '{name}'. Use 'semantic' or 'lexical'.")
+        try:
+            weight = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Weight '{name}' must be a number.")
+        if not math.isfinite(weight) or weight < 0:
+            raise ValueError(f"Weight '{name}' must be a finite number of at least 0.")
+        weights[name] = weight
+    return method, weights
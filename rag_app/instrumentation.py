@@ -0,0 +1,248 @@
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Stage timings of the request being handled in the current context, when
+# collected. A context variable (rather than a thread-local) follows async views
+# into the search executor, see pipeline.run_in_search_executor.
+_timings = ContextVar("rag_stage_timings", default=None)
+
+# Latency buckets in seconds, fine enough for sub-millisecond stages such as
+# BM25 scoring and wide enough for LLM generation on a CPU
+DURATION_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+
+class _Metric:
+    """
+    A labeled, thread-safe metric rendered in the Prometheus text format.
+
+    Values live in this process only: with several server workers, each one
+    exposes its own series on /metrics.
+    """
+
+    type_name = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self._lock:
+            values = dict(self._values)
+        for key in sorted(values):
+            lines.extend(self._render_value(key, values[key]))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{self._label_text(key)} {value}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket counts (not cumulative), then the sum and the count
+            counts, total, count = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0, 0)
+            )
+            counts = list(counts)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = self._label_text(key, [("le", le)])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {total}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds",
+    "Time spent in each stage of answering a question.",
+    ("stage",),
+)
+REQUEST_SECONDS = Histogram(
+    "rag_request_seconds",
+    "Time to produce a response, by endpoint.",
+    ("endpoint",),
+)
+REQUESTS = Counter(
+    "rag_requests_total",
+    "Requests handled, by endpoint and HTTP status.",
+    ("endpoint", "status"),
+)
+ANSWER_CACHE_LOOKUPS = Counter(
+    "rag_answer_cache_lookups_total",
+    "Answer cache lookups, by result (hit or miss).",
+    ("result",),
+)
+GENERATED_TOKENS = Counter("rag_generated_tokens_total", "Tokens generated by the LLM.")
+OLLAMA_ERRORS = Counter(
+    "rag_ollama_errors_total",
+    "Failed generation requests to Ollama, by kind (connection or other).",
+    ("kind",),
+)
+CROSS_ENCODER_FALLBACKS = Counter(
+    "rag_cross_encoder_fallbacks_total",
+    "Cross-encoder requests answered with the hybrid ranking, by reason "
+    "(timeout, overloaded or error).",
+    ("reason",),
+)
+RESOURCE_LOAD_SECONDS = Gauge(
+    "rag_resource_load_seconds",
+    "Time taken to load each search resource.",
+    ("resource",),
+)
+
+
+@contextmanager
+def stage(name):
+    """Times the block as stage `name` of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def record(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def collect():
+    """Collects the seconds spent in each stage by the current context into a dict."""
+    token = _timings.set({})
+    try:
+        yield _timings.get()
+    finally:
+        _timings.reset(token)
+
+
+def current_timings_ms():
+    """Stage timings collected so far for the current request, in milliseconds."""
+    timings = _timings.get() or {}
+    return {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+
+
+def instrument_view(endpoint):
+    """
+    Counts the requests of a view by status, times them, and collects their stage timings.
+
+    Works for sync and async views. Streaming responses are timed until the
+    response object is returned; their generation is timed as its own stage.
+    """
+
+    def observe(started, response):
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                started = time.perf_counter()
+                with collect():
+                    response = await view(request, *args, **kwargs)
+                observe(started, response)
+                return response
+
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            started = time.perf_counter()
+            with collect():
+                response = view(request, *args, **kwargs)
+            observe(started, response)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from rag_app.instrumentation import GENERATED_TOKENS, OLLAMA_ERRORS, stage
+
+OLLAMA_GENERATE_URL = "http://localhost:11434/api/generate"
+OLLAMA_MODEL = "tinyllama"
+
+# Bump whenever the prompt below changes so cached answers are not reused
+PROMPT_VERSION = 1
+
+UNABLE_TO_ANSWER = "I am unable to answer this question from the provided documents."
+GENERATION_ERROR_ANSWERS = (
+    "An error occurred during answer generation. Is Ollama running?",
+    "An error occurred during answer generation.",
+)
+
+
+def _ollama_config():
+    return {
+        "CONNECT_TIMEOUT": 5.0,
+        "READ_TIMEOUT": 120.0,
+        "MAX_CONNECTIONS": 16,
+        **getattr(settings, "RAG_OLLAMA", {}),
+    }
+
+
+def _make_session():
+    """A keep-alive session shared by every sync request in this process."""
+    pool_size = _ollama_config()["MAX_CONNECTIONS"]
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    return session
+
+
+_session = _make_session()
+
+# One pooled async client per event loop: an httpx.AsyncClient cannot be shared
+# across loops. Under ASGI that is a single long-lived client; under WSGI each
+# async request runs in its own short-lived loop (asgiref's async_to_sync), and
+# the client is closed when that loop shuts down.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+async def _close_on_loop_shutdown(client):
+    """
+    Closes `client` when its event loop finalizes its async generators.
+
+    asyncio.run() does that before closing the loop, which is the only hook
+    a loop offers for cleaning up after itself.
+    """
+    try:
+        yield
+    finally:
+        # The generator refers back to the loop, so the entry is dropped here
+        # rather than left to the weak reference
+        _async_clients.pop(asyncio.get_running_loop(), None)
+        await client.aclose()
+
+
+async def get_async_client():
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        config = _ollama_config()
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                config["READ_TIMEOUT"], connect=config["CONNECT_TIMEOUT"]
+            ),
+            limits=httpx.Limits(
+                max_connections=config["MAX_CONNECTIONS"],
+                max_keepalive_connections=config["MAX_CONNECTIONS"],
+            ),
+        )
+        # The closer is kept with the client so that it lives as long as the loop
+        entry = _async_clients[loop] = (client, _close_on_loop_shutdown(client))
+        await entry[1].__anext__()
+    return entry[0]
+
+
+def build_prompt(query, contexts):
+    """Builds the TinyLlama prompt with numbered contexts for citation."""
+    context_text = "\n\n".join(
+        [f"({i + 1}) {c['text']}" for i, c in enumerate(contexts)]
+    )
+
+    return f"""
+Use the following pieces of context to answer the question. If the answer is not in the provided context, politely state that you cannot answer from the given information. Provide a short, concise answer and always include the citation number(s) from the context.
+Context:
+{context_text}
+Question:
+{query}
+"""
+
+
+def ollama_payload(query, contexts, stream=False):
+    return {
+        "model": OLLAMA_MODEL,
+        "prompt": build_prompt(query, contexts),
+        "stream": stream,
+        "options": {
+            "temperature": 0.1,
+            "num_ctx": 2048,  # Increase context window for better performance
+        },
+    }
+
+
+def is_refusal(answer):
+    """A simple check for "I cannot answer" based on the prompt."""
+    return (
+        "cannot answer" in answer.lower() or "i am unable to answer" in answer.lower()
+    )
+
+
+def build_citations(contexts):
+    """One citation per distinct document title, in context order, with the cited pages."""
+    citations = {}
+    for c in contexts:
+        cite = citations.setdefault(
+            c["title"], {"title": c["title"], "link": c["link"], "pages": []}
+        )
+        page = c.get("page")
+        if page and page not in cite["pages"]:
+            cite["pages"].append(page)
+    for cite in citations.values():
+        cite["pages"].sort()
+    return list(citations.values())
+
+
+def finalize_answer(answer, contexts):
+    """Turns the raw LLM output into the (answer, citations) returned by the API."""
+    answer = answer.strip()
+    if is_refusal(answer):
+        return UNABLE_TO_ANSWER, []
+    return answer, build_citations(contexts)
+
+
+def generate_answer(query, contexts):
+    """Generates a concise, cited answer using a local Ollama LLM and the provided contexts."""
+    try:
+        config = _ollama_config()
+        with stage("generation"):
+            response = _session.post(
+                OLLAMA_GENERATE_URL,
+                json=ollama_payload(query, contexts),
+                timeout=(config["CONNECT_TIMEOUT"], config["READ_TIMEOUT"]),
+            )
+            response.raise_for_status()
+
+        full_response = json.loads(response.text)
+        GENERATED_TOKENS.inc(full_response.get("eval_count", 0))
+        return finalize_answer(full_response["response"], contexts)
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error communicating with Ollama: {e}")
+        OLLAMA_ERRORS.inc(kind="connection")
+        return GENERATION_ERROR_ANSWERS[0], []
+
+    except Exception as e:
+        print(f"Error during LLM generation: {e}")
+        OLLAMA_ERRORS.inc(kind="other")
+        return GENERATION_ERROR_ANSWERS[1], []
+
+
+async def agenerate_answer(query, contexts):
+    """
+    Async counterpart of generate_answer using the pooled httpx client.
+
+    If the caller is cancelled (for example because the client disconnected),
+    the in-flight request to Ollama is closed, which stops the generation.
+    """
+    try:
+        with stage("generation"):
+            client = await get_async_client()
+            response = await client.post(
+                OLLAMA_GENERATE_URL, json=ollama_payload(query, contexts)
+            )
+            response.raise_for_status()
+
+        full_response = response.json()
+        GENERATED_TOKENS.inc(full_response.get("eval_count", 0))
+        return finalize_answer(full_response["response"], contexts)
+
+    except httpx.HTTPError as e:
+        print(f"Error communicating with Ollama: {e}")
+        OLLAMA_ERRORS.inc(kind="connection")
+        return GENERATION_ERROR_ANSWERS[0], []
+
+    except Exception as e:
+        print(f"Error during LLM generation: {e}")
+        OLLAMA_ERRORS.inc(kind="other")
+        return GENERATION_ERROR_ANSWERS[1], []
+
+
+def stream_answer(query, contexts):
+    """
+    Yields answer tokens as Ollama produces them.
+
+    Errors are raised to the caller, which decides how to report them mid-stream.
+    """
+    config = _ollama_config()
+    num_tokens = 0
+    with stage("generation"), _session.post(
+        OLLAMA_GENERATE_URL,
+        json=ollama_payload(query, contexts, stream=True),
+        stream=True,
+        timeout=(config["CONNECT_TIMEOUT"], config["READ_TIMEOUT"]),
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                num_tokens += 1
+                yield chunk["response"]
+            if chunk.get("done"):
+                num_tokens = chunk.get("eval_count", num_tokens)
+                break
+    GENERATED_TOKENS.inc(num_tokens)
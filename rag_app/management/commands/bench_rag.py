@@ -0,0 +1,409 @@
+import json
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from rag_app import resources
+from rag_app.instrumentation import collect, stage
+from rag_app.llm import GENERATION_ERROR_ANSWERS, finalize_answer, generate_answer
+from rag_app.pipeline import (
+    MODES,
+    parse_ask_request,
+    rank_rows,
+    search_candidates,
+    select_contexts,
+    start_lexical_search,
+)
+from rag_app.vector_index import describe_index
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Numbered, bold questions as written in questions.md
+QUESTION_PATTERN = re.compile(r"^\s*\d+\.\s+\*\*(.+?)\*\*", re.MULTILINE)
+# Used instead of calling Ollama with --llm stub; it cites the first context
+STUB_ANSWER = "Stubbed answer (1)."
+# Words taken from the start of a chunk for a synthetic query
+SYNTHETIC_WORDS = 12
+# Queries run once before measuring
+WARMUP_QUERIES = 5
+PERCENTILES = (50, 95, 99)
+STAGE_ORDER = (
+    "encode",
+    "faiss",
+    "search",
+    "lexical_search",
+    "lexical",
+    "fusion",
+    "cross_encoder",
+    "contexts",
+    "generation",
+    "total",
+)
+
+
+def load_queries(path):
+    """
+    Reads the queries of a questions.md-style markdown file or a JSON-lines file.
+
+    Each JSON line is an /ask body such as {"q": "...", "mode": "reranker"}, or a
+    plain string. An optional "relevant" list labels the query for recall@k/MRR.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".md"):
+        # questions.md lists every question under more than one heading
+        questions = dict.fromkeys(q.strip() for q in QUESTION_PATTERN.findall(text))
+        return [{"q": question} for question in questions]
+
+    queries = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if isinstance(item, str):
+            item = {"q": item}
+        if isinstance(item, dict) and item.get("q"):
+            queries.append(item)
+    return queries
+
+
+def synthetic_queries(count, seed=0):
+    """Queries made of the opening words of random chunks, labeled with that chunk."""
+    chunk_store = resources.chunk_store
+    rows = np.flatnonzero(chunk_store.ids >= 0)
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(rows, min(count, len(rows)), replace=False)
+    return [
+        {
+            "q": " ".join(chunk_store.text(row).split()[:SYNTHETIC_WORDS]),
+            "relevant": [int(chunk_store.ids[row])],
+        }
+        for row in rows
+    ]
+
+
+def rank_metrics(hits, relevant, k):
+    """
+    Returns (recall@k, reciprocal rank) of ranked (chunk id, document title) hits.
+
+    `relevant` lists Chunk ids and/or document titles; a hit matches either.
+    """
+    relevant = set(relevant)
+    found, first_rank = set(), None
+    for rank, (chunk_id, title) in enumerate(hits[:k], start=1):
+        matched = relevant & {chunk_id, title}
+        if matched:
+            found |= matched
+            first_rank = first_rank or rank
+    return len(found) / len(relevant), 1.0 / first_rank if first_rank else 0.0
+
+
+def summarize(seconds):
+    """Latency percentiles in milliseconds."""
+    ms = np.asarray(seconds) * 1000
+    summary = {"count": len(ms), "mean_ms": round(float(ms.mean()), 3)}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(float(np.percentile(ms, p)), 3)
+    return summary
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a query set against the search pipeline and reports per-stage "
+        "latency, throughput, memory and retrieval quality."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queries",
+            default="questions.md",
+            help="questions.md-style markdown or a JSON-lines file of /ask bodies.",
+        )
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            help="Use N queries made from random chunks instead of --queries.",
+        )
+        parser.add_argument(
+            "--relevance",
+            help=(
+                "JSON file mapping each query to its relevant Chunk ids and/or "
+                "document titles, for recall@k and MRR."
+            ),
+        )
+        parser.add_argument("-k", type=int, default=5, help="Default k per query.")
+        parser.add_argument(
+            "--mode", choices=MODES, default="reranker", help="Default search mode."
+        )
+        parser.add_argument(
+            "--llm",
+            choices=("stub", "live"),
+            default="stub",
+            help="Generate answers with Ollama (live) or a fixed answer (stub).",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3, help="Passes over the query set."
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=1, help="Queries in flight at once."
+        )
+        parser.add_argument(
+            "--use-caches",
+            action="store_true",
+            help="Keep the query embedding cache on (off by default).",
+        )
+        parser.add_argument(
+            "--micro-batching",
+            action="store_true",
+            help=(
+                "Keep micro-batching on if configured; encode and FAISS are then "
+                "reported together as 'search'."
+            ),
+        )
+        parser.add_argument(
+            "--output", default="bench_rag.json", help="Where to write the results."
+        )
+        parser.add_argument(
+            "--baseline", help="Results of an earlier run to compare against."
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed for --synthetic queries."
+        )
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write("Loading search resources...")
+        success, error_msg = resources.load_resources()
+        if not success:
+            raise CommandError(error_msg)
+
+        # Measure the pipeline itself, not a warm cache
+        if not kwargs["use_caches"]:
+            resources.query_embedding_cache = None
+        if not kwargs["micro_batching"]:
+            resources.micro_batcher = None
+        self.live = kwargs["llm"] == "live"
+
+        # Step 1: Build the query set
+        if kwargs["synthetic"]:
+            queries = synthetic_queries(kwargs["synthetic"], kwargs["seed"])
+            source = f"synthetic:{kwargs['synthetic']}"
+        else:
+            try:
+                queries = load_queries(kwargs["queries"])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read {kwargs['queries']}: {e}")
+            source = kwargs["queries"]
+        if not queries:
+            raise CommandError(f"No queries found in {source}.")
+
+        if kwargs["relevance"]:
+            with open(kwargs["relevance"], "r", encoding="utf-8") as f:
+                labels = json.load(f)
+            for item in queries:
+                item.setdefault("relevant", labels.get(item["q"]))
+
+        defaults = {"k": kwargs["k"], "mode": kwargs["mode"]}
+        try:
+            workload = [parse_ask_request({**defaults, **item}) for item in queries]
+        except (TypeError, ValueError) as e:
+            raise CommandError(f"Invalid query: {e}")
+
+        # Step 2: Warm up, then replay the query set
+        for options in workload[:WARMUP_QUERIES]:
+            self.run_query(options)
+
+        self.stdout.write(
+            f"Running {len(workload)} queries x {kwargs['repeat']} passes "
+            f"with concurrency {kwargs['concurrency']} (LLM: {kwargs['llm']})..."
+        )
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, kwargs["concurrency"])) as pool:
+            results = list(pool.map(self.run_query, workload * kwargs["repeat"]))
+        elapsed = time.perf_counter() - started
+
+        # Step 3: Aggregate latency per stage, throughput and quality
+        samples = {}
+        for timings, _, _ in results:
+            for name, seconds in timings.items():
+                samples.setdefault(name, []).append(seconds)
+        stages = {
+            name: summarize(samples[name])
+            for name in sorted(
+                samples,
+                key=lambda name: (
+                    STAGE_ORDER.index(name) if name in STAGE_ORDER else len(STAGE_ORDER)
+                ),
+            )
+        }
+
+        report = {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "corpus_version": resources.corpus_version,
+            "index": {
+                "type": describe_index(resources.faiss_index),
+                "vectors": int(resources.faiss_index.ntotal),
+            },
+            "config": {
+                "queries": source,
+                "num_queries": len(workload),
+                "repeat": kwargs["repeat"],
+                "concurrency": kwargs["concurrency"],
+                "k": kwargs["k"],
+                "mode": kwargs["mode"],
+                "llm": kwargs["llm"],
+                "use_caches": kwargs["use_caches"],
+                "micro_batching": resources.micro_batcher is not None,
+            },
+            "stages": stages,
+            "throughput": {
+                "requests": len(results),
+                "seconds": round(elapsed, 3),
+                "qps": round(len(results) / elapsed, 2),
+            },
+            "peak_rss_mb": peak_rss_mb(),
+            "generation_errors": sum(failed for _, _, failed in results),
+            "quality": self.quality(queries, workload, results[: len(workload)]),
+        }
+
+        self.print_report(report)
+        if kwargs["baseline"]:
+            self.compare(report, kwargs["baseline"])
+
+        with open(kwargs["output"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results saved to {kwargs['output']}"))
+
+    def run_query(self, options):
+        """Runs one query through the pipeline; returns (stage timings, hits, failed)."""
+        with collect() as timings:
+            with stage("total"):
+                lexical_search = start_lexical_search(options)
+                distances, faiss_ids = search_candidates(options)
+                rows, scores, label = rank_rows(
+                    options, distances, faiss_ids, lexical_search
+                )
+                contexts = select_contexts(rows, scores, label, options["k"])
+                if self.live:
+                    # Times itself as the "generation" stage
+                    answer, _ = generate_answer(options["query"], contexts)
+                else:
+                    with stage("generation"):
+                        answer, _ = finalize_answer(STUB_ANSWER, contexts)
+
+        chunk_store = resources.chunk_store
+        hits = [
+            (
+                int(chunk_store.ids[row]),
+                chunk_store.documents[chunk_store.doc_index[row]]["title"],
+            )
+            for row in rows
+        ]
+        return timings, hits, answer in GENERATION_ERROR_ANSWERS
+
+    def quality(self, queries, workload, results):
+        """Mean recall@k and MRR over the labeled queries, or None if none are labeled."""
+        recalls, reciprocal_ranks = [], []
+        for item, options, (_, hits, _) in zip(queries, workload, results):
+            if not item.get("relevant"):
+                continue
+            recall, reciprocal_rank = rank_metrics(hits, item["relevant"], options["k"])
+            recalls.append(recall)
+            reciprocal_ranks.append(reciprocal_rank)
+        if not recalls:
+            return None
+        return {
+            "labeled_queries": len(recalls),
+            "recall_at_k": round(float(np.mean(recalls)), 4),
+            "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{'Stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}"
+        )
+        for name, summary in report["stages"].items():
+            self.stdout.write(
+                f"{name:<16}{summary['p50_ms']:>10.3f}{summary['p95_ms']:>10.3f}"
+                f"{summary['p99_ms']:>10.3f}{summary['mean_ms']:>10.3f}"
+            )
+
+        throughput = report["throughput"]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{throughput['requests']} requests in {throughput['seconds']}s: "
+                f"{throughput['qps']} QPS at concurrency "
+                f"{report['config']['concurrency']}; peak RSS "
+                f"{report['peak_rss_mb']} MB."
+            )
+        )
+        if report["generation_errors"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{report['generation_errors']} answers failed to generate."
+                )
+            )
+
+        quality = report["quality"]
+        if quality is None:
+            self.stdout.write(
+                "No relevance labels; pass --relevance or --synthetic for recall/MRR."
+            )
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Recall@{report['config']['k']} {quality['recall_at_k']:.3f}, "
+                    f"MRR {quality['mrr']:.3f} over {quality['labeled_queries']} "
+                    "labeled queries."
+                )
+            )
+
+    def compare(self, report, baseline_path):
+        """Prints the change of each stage's p50/p95 and of QPS against an earlier run."""
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        self.stdout.write(
+            f"Compared with {baseline_path} (commit {baseline.get('commit')}):"
+        )
+        for name, summary in report["stages"].items():
+            previous = baseline.get("stages", {}).get(name)
+            if not previous:
+                continue
+            changes = []
+            for key in ("p50_ms", "p95_ms"):
+                if previous[key]:
+                    change = 100 * (summary[key] / previous[key] - 1)
+                    changes.append(f"{key[:3]} {change:+.1f}%")
+            self.stdout.write(f"  {name:<16}{', '.join(changes)}")
+        previous_qps = baseline.get("throughput", {}).get("qps")
+        if previous_qps:
+            change = 100 * (report["throughput"]["qps"] / previous_qps - 1)
+            self.stdout.write(f"  {'qps':<16}{change:+.1f}%")
@@ -1,34 +1,146 @@
 import os
+import time
 import faiss
 import numpy as np
 import json
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from sentence_transformers import SentenceTransformer
+from rag_app.artifacts import current_corpus_version, read_manifest, write_artifacts
+from rag_app.bm25 import BM25Index
+from rag_app.cache import invalidate_answer_cache
+from rag_app.chunk_store import ChunkStore
+from rag_app.embedding_store import EmbeddingStore
 from rag_app.models import Chunk
+from rag_app.vector_index import (
+    DEFAULT_HNSW_M,
+    DEFAULT_SEARCH_CONFIG,
+    build_index,
+    content_hashes,
+    describe_index,
+    factory_string,
+    is_keyed_by_id,
+    read_embedded_chunks,
+    recall_at_k,
+    search_parameters,
+    write_embedded_chunks,
+    write_index,
+)
 
 # Define the paths for the generated files
 EMBEDDINGS_DIR = "embeddings"
 INDEX_FILE = os.path.join(EMBEDDINGS_DIR, "chunks.index")
 MAPPING_FILE = os.path.join(EMBEDDINGS_DIR, "chunk_id_map.json")
+EMBEDDED_CHUNKS_FILE = os.path.join(EMBEDDINGS_DIR, "embedded_chunks.npy")
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_STORE_DIR = os.path.join(EMBEDDINGS_DIR, "embedding_store", MODEL_NAME)
+# Batches encoded between progress lines
+PROGRESS_BATCHES = 16
+# Options of the index type, recorded in the manifest so rebuilds keep them
+INDEX_PARAMETERS = ("nlist", "pq_m", "hnsw_m")
 
 
 class Command(BaseCommand):
     help = "Generates embeddings for all document chunks and builds a FAISS index."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stem",
+            action="store_true",
+            help="Apply light stemming when building the BM25 keyword index.",
+        )
+        parser.add_argument(
+            "--no-embedding-store",
+            action="store_true",
+            help="Encode every chunk instead of reusing vectors from the embedding store.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Re-encode every chunk and rebuild the index from scratch.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=64,
+            help="Chunks encoded per model batch.",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help=(
+                "Encode in this many CPU processes with a sentence-transformers "
+                "multi-process pool (default: 1, in this process)."
+            ),
+        )
+        parser.add_argument(
+            "--index-spec",
+            help=(
+                "FAISS index type: flat, ivfflat, ivfpq, hnsw, or any "
+                "faiss.index_factory string such as 'IVF1024,PQ48'. Defaults to "
+                "the spec and parameters of the existing index, or flat. "
+                "Changing either forces a full rebuild."
+            ),
+        )
+        parser.add_argument(
+            "--nlist",
+            type=int,
+            help="Inverted lists for IVF indexes (default: about 4 * sqrt(chunks)).",
+        )
+        parser.add_argument(
+            "--pq-m",
+            type=int,
+            help="Sub-quantizers for ivfpq; must divide the embedding dimension.",
+        )
+        parser.add_argument(
+            "--hnsw-m",
+            type=int,
+            help=f"Neighbours per node for hnsw (default: {DEFAULT_HNSW_M}).",
+        )
+        parser.add_argument(
+            "--train-size",
+            type=int,
+            default=50000,
+            help="Maximum number of vectors used to train IVF/PQ indexes.",
+        )
+        parser.add_argument(
+            "--recall-queries",
+            type=int,
+            default=200,
+            help="Held-out chunks used to measure recall against an exact index (0 to skip).",
+        )
+        parser.add_argument(
+            "--recall-k", type=int, default=10, help="k for the recall@k report."
+        )
+
     def handle(self, *args, **kwargs):
         # Create the embeddings directory if it doesn't exist
         os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
-        self.stdout.write("Initializing Sentence Transformer model...")
+        self.model = None
+        self.batch_size = max(1, kwargs["batch_size"])
+        self.processes = max(1, kwargs["processes"])
 
-        # Step 1: Load the pre-trained Sentence Transformer model
-        # The assessment specifies 'all-MiniLM-L6-v2'
-        model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.stdout.write(self.style.SUCCESS("Model loaded successfully."))
+        # Vectors of every chunk text embedded before, keyed by content hash
+        store_config = getattr(settings, "RAG_EMBEDDING_STORE", {})
+        self.embedding_store = None
+        if store_config.get("ENABLED", True) and not kwargs["no_embedding_store"]:
+            self.embedding_store = EmbeddingStore(
+                EMBEDDING_STORE_DIR,
+                MODEL_NAME,
+                dtype=store_config.get("DTYPE", "float32"),
+            )
 
-        # Step 2: Retrieve all text chunks from the database
+        # Step 1: Retrieve all text chunks from the database. Rows are streamed
+        # straight into the compact chunk store, which then serves the texts to
+        # every later step instead of a list of Chunk objects.
         self.stdout.write("Fetching chunks from the database...")
-        chunks = list(Chunk.objects.all().order_by("id"))
-        if not chunks:
+        corpus_version = current_corpus_version()
+        chunk_ids = np.fromiter(
+            Chunk.objects.order_by("id").values_list("id", flat=True).iterator(),
+            dtype=np.int64,
+        )
+        if not len(chunk_ids):
             self.stdout.write(
                 self.style.ERROR(
                     "No chunks found in the database. Please run `import_pdfs` first."
@@ -36,35 +148,351 @@ class Command(BaseCommand):
             )
             return
 
-        chunk_texts = [chunk.chunk_text for chunk in chunks]
+        chunk_store = ChunkStore.from_database(chunk_ids)
+        try:
+            previous_manifest = read_manifest(EMBEDDINGS_DIR)
+        except (FileNotFoundError, ValueError):
+            previous_manifest = {}
+        previous_metadata = previous_manifest.get("faiss_index", {})
+        index_options, changed_options = self.index_options(kwargs, previous_metadata)
+        hashes = content_hashes(
+            chunk_store.text(row) for row in range(len(chunk_store))
+        )
+
+        # Step 2: Update the existing index in place when possible, so that only
+        # new or edited chunks are encoded
+        index, index_metadata = None, None
+        self.index_changed = True
+        if not kwargs["full"]:
+            index, index_metadata = self.update_index(
+                chunk_ids, chunk_store, hashes, changed_options, previous_metadata
+            )
+
+        # Steps 3-4: Otherwise encode every chunk and build a new index
+        if index is None:
+            index, index_metadata = self.build_full_index(
+                chunk_ids,
+                chunk_store,
+                hashes,
+                {**kwargs, **index_options},
+            )
+            if index is None:
+                return
+
+        # Step 5: Save the index and a mapping of chunk IDs. Each file is written
+        # to a temporary path and renamed, so readers never see a partial file.
+        self.stdout.write("Saving FAISS index and ID mapping...")
+        write_index(index, INDEX_FILE)
+        write_embedded_chunks(EMBEDDED_CHUNKS_FILE, chunk_ids, hashes)
+
+        # Map each chunk-store row to its Django Chunk ID; the index itself
+        # returns Chunk IDs, which the server resolves to these rows
+        chunk_id_map = {i: int(chunk_id) for i, chunk_id in enumerate(chunk_ids)}
+        with open(f"{MAPPING_FILE}.tmp", "w") as f:
+            json.dump(chunk_id_map, f)
+        os.replace(f"{MAPPING_FILE}.tmp", MAPPING_FILE)
 
+        self.stdout.write(self.style.SUCCESS(f"Index saved to {INDEX_FILE}"))
+        self.stdout.write(self.style.SUCCESS(f"ID mapping saved to {MAPPING_FILE}"))
+
+        # Step 6: Build the BM25 keyword index over the same rows as the chunk store
+        self.stdout.write("Building BM25 keyword index...")
+        bm25_index = BM25Index.build(
+            (chunk_store.text(row) for row in range(len(chunk_store))),
+            use_stemming=kwargs["stem"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"BM25 index built with {len(bm25_index.vocabulary)} terms."
+            )
+        )
+
+        # Step 7: Save the chunk store and BM25 index as memory-mappable artifacts
+        self.stdout.write("Saving search artifacts...")
+        manifest = write_artifacts(
+            EMBEDDINGS_DIR,
+            chunk_store,
+            bm25_index,
+            corpus_version,
+            extra={"faiss_index": index_metadata},
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Artifacts for corpus version {manifest['corpus_version']} "
+                f"saved to {EMBEDDINGS_DIR}"
+            )
+        )
+        # Answers cached for the previous index must not be served any more.
+        # A run that changed neither the index nor the artifacts keeps them.
+        if self.index_changed or manifest["files"] != previous_manifest.get("files"):
+            invalidate_answer_cache()
+        else:
+            self.stdout.write(
+                "Nothing changed since the last run; cached answers kept."
+            )
+        self.stdout.write(self.style.SUCCESS("Embedding process complete."))
+
+    def encode(self, texts):
+        """
+        Encodes texts in batches, loading the model on first use so no-op updates skip it.
+
+        Texts are encoded longest first, so each batch holds texts of similar
+        length and little of it is padding. The result is in the original order.
+        """
+        if self.model is None:
+            self.stdout.write("Initializing Sentence Transformer model...")
+            # The assessment specifies 'all-MiniLM-L6-v2'
+            self.model = SentenceTransformer(MODEL_NAME)
+            self.stdout.write(self.style.SUCCESS("Model loaded successfully."))
+
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty(
+            (len(texts), self.model.get_sentence_embedding_dimension()),
+            dtype=np.float32,
+        )
+        pool = None
+        if self.processes > 1:
+            pool = self.model.start_multi_process_pool(
+                target_devices=["cpu"] * self.processes
+            )
+        started = time.perf_counter()
+        try:
+            step = self.batch_size * self.processes * PROGRESS_BATCHES
+            for start in range(0, len(texts), step):
+                rows = order[start : start + step]
+                window = [texts[row] for row in rows]
+                if pool is None:
+                    encoded = self.model.encode(
+                        window, batch_size=self.batch_size, convert_to_numpy=True
+                    )
+                else:
+                    encoded = self.model.encode_multi_process(
+                        window, pool, batch_size=self.batch_size
+                    )
+                embeddings[rows] = encoded
+                done = start + len(rows)
+                self.stdout.write(
+                    f"  Encoded {done}/{len(texts)} chunks "
+                    f"({done / (time.perf_counter() - started):.1f} chunks/sec)"
+                )
+        finally:
+            if pool is not None:
+                self.model.stop_multi_process_pool(pool)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Encoded {len(texts)} chunks in {elapsed:.1f}s "
+                f"({len(texts) / max(elapsed, 1e-9):.1f} chunks/sec, batch size "
+                f"{self.batch_size}, {self.processes} process(es))."
+            )
+        )
+        return embeddings
+
+    def embed(self, texts, hashes):
+        """Returns embeddings of texts, reusing vectors from the embedding store."""
+        self.stdout.write(f"Generating embeddings for {len(texts)} chunks...")
+        if self.embedding_store is None:
+            return self.encode(texts)
+
+        embeddings, num_encoded = self.embedding_store.embed(texts, hashes, self.encode)
+        self.stdout.write(
+            f"Reused {len(texts) - num_encoded} stored embeddings, "
+            f"encoded {num_encoded} new texts."
+        )
+        return embeddings
+
+    def index_options(self, kwargs, previous_metadata):
+        """
+        Returns the index spec and parameters to build with, and those that changed.
+
+        Options given on the command line win. The others are the ones recorded
+        for the existing index when the spec is the same, so a rebuild keeps the
+        index type and its parameters; without an existing index it is flat.
+        """
+        previous_spec = previous_metadata.get("spec")
+        spec = kwargs["index_spec"] or previous_spec or "flat"
+        previous = {
+            "index_spec": previous_spec,
+            **(previous_metadata.get("params", {}) if spec == previous_spec else {}),
+        }
+        options = {"index_spec": spec}
+        for name in INDEX_PARAMETERS:
+            options[name] = (
+                kwargs[name] if kwargs[name] is not None else previous.get(name)
+            )
+        changed = [
+            name
+            for name, value in options.items()
+            if kwargs[name] is not None and value != previous.get(name)
+        ]
+        return options, changed
+
+    def update_index(
+        self, chunk_ids, chunk_store, hashes, changed_options, previous_metadata
+    ):
+        """
+        Applies the chunk changes since the last run to the existing index.
+
+        Vectors of deleted or edited chunks are removed by Chunk.id and new or
+        edited chunks are encoded and added. Returns (None, None) when the
+        index has to be rebuilt from scratch instead.
+        """
+        previous = read_embedded_chunks(EMBEDDED_CHUNKS_FILE)
+        if previous is None or not os.path.exists(INDEX_FILE):
+            self.stdout.write("No previous index found; building a new one.")
+            return None, None
+
+        if changed_options:
+            options = ", ".join(
+                "--" + name.replace("_", "-") for name in changed_options
+            )
+            self.stdout.write(
+                self.style.NOTICE(
+                    f"{options} changed from the existing index "
+                    f"({previous_metadata.get('factory')}); rebuilding."
+                )
+            )
+            return None, None
+
+        index = faiss.read_index(INDEX_FILE)
+        if not is_keyed_by_id(index) or index.ntotal != len(previous):
+            self.stdout.write(
+                self.style.NOTICE("The existing index cannot be updated; rebuilding.")
+            )
+            return None, None
+
+        current = dict(zip(chunk_ids.tolist(), hashes.tolist()))
+        embedded = dict(
+            zip(previous["chunk_id"].tolist(), previous["content_hash"].tolist())
+        )
+        stale_ids = [
+            chunk_id
+            for chunk_id, content_hash in embedded.items()
+            if current.get(chunk_id) != content_hash
+        ]
+        new_rows = [
+            row
+            for row, (chunk_id, content_hash) in enumerate(current.items())
+            if embedded.get(chunk_id) != content_hash
+        ]
+
+        if stale_ids and describe_index(index) == "hnsw":
+            self.stdout.write(
+                self.style.NOTICE("HNSW indexes cannot remove vectors; rebuilding.")
+            )
+            return None, None
+
+        self.index_changed = bool(stale_ids or new_rows)
+        if stale_ids:
+            index.remove_ids(np.array(stale_ids, dtype=np.int64))
+        if new_rows:
+            embeddings = self.embed(chunk_store.texts(new_rows), hashes[new_rows])
+            index.add_with_ids(
+                np.ascontiguousarray(embeddings, dtype=np.float32),
+                chunk_ids[new_rows],
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Index updated: {len(new_rows)} vectors added, "
+                f"{len(stale_ids)} vectors removed, {index.ntotal} vectors in total."
+            )
+        )
+        # Recall was measured on the corpus the index was built for
+        metadata = {
+            name: value for name, value in previous_metadata.items() if name != "recall"
+        }
+        return index, metadata
+
+    def build_full_index(self, chunk_ids, chunk_store, hashes, kwargs):
+        """Encodes every chunk and builds a new index; returns (index, metadata)."""
         # Step 3: Generate embeddings for all chunks
-        self.stdout.write(f"Generating embeddings for {len(chunks)} chunks...")
-        embeddings = model.encode(chunk_texts, convert_to_numpy=True)
+        embeddings = self.embed(chunk_store.texts(range(len(chunk_store))), hashes)
         self.stdout.write(self.style.SUCCESS("Embeddings generated."))
 
         # Step 4: Create a FAISS index
         # We need the dimensionality of our embeddings. all-MiniLM-L6-v2 is 384.
         dimension = embeddings.shape[1]
-        self.stdout.write(f"Creating a FAISS index with dimension {dimension}...")
+        factory = factory_string(
+            kwargs["index_spec"],
+            len(embeddings),
+            dimension,
+            nlist=kwargs["nlist"],
+            pq_m=kwargs["pq_m"],
+            hnsw_m=kwargs["hnsw_m"],
+        )
+        self.stdout.write(
+            f"Creating a FAISS index '{factory}' with dimension {dimension}..."
+        )
 
-        # We'll use an IndexFlatL2, which is a simple and effective index for L2 (Euclidean) distance
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings)
+        # Flat is exact L2 search; IVF/PQ/HNSW trade a little recall for speed and
+        # memory on large corpora. Held-out chunks are kept out of the training
+        # sample so the recall report below is not flattered.
+        rng = np.random.default_rng(0)
+        num_queries = min(kwargs["recall_queries"], len(embeddings))
+        query_rows = np.sort(rng.choice(len(embeddings), num_queries, replace=False))
+        try:
+            index = build_index(
+                embeddings,
+                chunk_ids,
+                factory,
+                train_size=kwargs["train_size"],
+                held_out_rows=query_rows,
+            )
+        except RuntimeError as e:
+            self.stdout.write(self.style.ERROR(f"Failed to build the index: {e}"))
+            return None, None
 
         self.stdout.write(
             self.style.SUCCESS(f"FAISS index created with {index.ntotal} vectors.")
         )
 
-        # Step 5: Save the index and a mapping of chunk IDs
-        self.stdout.write("Saving FAISS index and ID mapping...")
-        faiss.write_index(index, INDEX_FILE)
+        index_metadata = {
+            "spec": kwargs["index_spec"],
+            "factory": factory,
+            # Only the parameters that were set, so a rebuild derives the
+            # others (such as nlist) again for the corpus it is built for
+            "params": {
+                name: kwargs[name]
+                for name in INDEX_PARAMETERS
+                if kwargs[name] is not None
+            },
+        }
+        if factory != "Flat" and num_queries:
+            index_metadata["recall"] = self.report_recall(
+                index, embeddings, chunk_ids, query_rows, kwargs["recall_k"]
+            )
+        return index, index_metadata
 
-        # Create a mapping from the FAISS index ID to your Django Chunk ID
-        chunk_id_map = {i: chunk.id for i, chunk in enumerate(chunks)}
-        with open(MAPPING_FILE, "w") as f:
-            json.dump(chunk_id_map, f)
+    def report_recall(self, index, embeddings, chunk_ids, query_rows, k):
+        """Measures recall@k of the new index against exact search at the server's settings."""
+        reference = faiss.IndexIDMap(faiss.IndexFlatL2(embeddings.shape[1]))
+        reference.add_with_ids(embeddings, chunk_ids)
 
-        self.stdout.write(self.style.SUCCESS(f"Index saved to {INDEX_FILE}"))
-        self.stdout.write(self.style.SUCCESS(f"ID mapping saved to {MAPPING_FILE}"))
-        self.stdout.write(self.style.SUCCESS("Embedding process complete."))
+        search_config = {
+            **DEFAULT_SEARCH_CONFIG,
+            **getattr(settings, "RAG_FAISS_SEARCH", {}),
+        }
+        params = search_parameters(
+            index,
+            nprobe=search_config["NPROBE"],
+            ef_search=search_config["EF_SEARCH"],
+        )
+        recall, exact_ms, approx_ms = recall_at_k(
+            index, reference, embeddings[query_rows], k, params=params
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recall@{k} over {len(query_rows)} held-out chunks: {recall:.3f} "
+                f"({approx_ms:.3f} ms/query vs {exact_ms:.3f} ms/query exact, "
+                f"nprobe={search_config['NPROBE']}, efSearch={search_config['EF_SEARCH']})"
+            )
+        )
+        return {
+            "k": k,
+            "queries": len(query_rows),
+            "recall": round(recall, 4),
+            "nprobe": search_config["NPROBE"],
+            "ef_search": search_config["EF_SEARCH"],
+        }
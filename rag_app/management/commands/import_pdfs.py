@@ -1,10 +1,17 @@
 import os
 import json
 import re
-from django.core.management.base import BaseCommand
+import time
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rag_app.artifacts import file_sha256
+from rag_app.cache import invalidate_answer_cache
+from rag_app.chunking import DEFAULT_CONFIG, STRATEGIES, ChunkStats, get_chunker
+from rag_app.extraction import process_pdf, read_spool
 from rag_app.models import Document, Chunk
-from PyPDF2 import PdfReader
-from PyPDF2.errors import PdfReadError
 
 BASE_FOLDER = r"D:/Assesment/Data"
 SOURCES_JSON_PATH = os.path.join(BASE_FOLDER, "sources.json")
@@ -60,49 +67,247 @@ class Command(BaseCommand):
             action="store_true",
             help="Deletes all existing documents and chunks before re-importing.",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Processes extracting PDFs in parallel (default: 1, in-process).",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=300.0,
+            help="Seconds allowed to extract one PDF before it is skipped (0 for no limit).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Chunks per INSERT statement when saving a document.",
+        )
+        parser.add_argument(
+            "--chunker",
+            choices=STRATEGIES,
+            help="Chunking strategy (default: RAG_CHUNKING['STRATEGY']).",
+        )
+        parser.add_argument("--chunk-tokens", type=int, help="Target tokens per chunk.")
+        parser.add_argument(
+            "--overlap-tokens",
+            type=int,
+            help="Tokens repeated from the end of one chunk at the start of the next.",
+        )
+        parser.add_argument(
+            "--max-tokens", type=int, help="Hard cap on tokens per chunk."
+        )
 
-    def extract_text_from_pdf(self, file_path):
-        try:
-            reader = PdfReader(file_path)
-            text = ""
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-            return text
-        except PdfReadError as e:
-            self.stdout.write(
-                self.style.WARNING(f"Skipping corrupted PDF '{file_path}': {e}")
-            )
-            return ""
-        except Exception as ex:
-            self.stdout.write(
-                self.style.WARNING(f"Unexpected error with '{file_path}': {ex}")
-            )
-            return ""
-
-    def chunk_text(self, text, chunk_size=500):
-        paragraphs = text.split("\n\n")
-        chunks = []
-        current_chunk = ""
-        for para in paragraphs:
-            if len(current_chunk) + len(para) < chunk_size:
-                current_chunk += para + "\n\n"
+    def purge(self):
+        """
+        Deletes every chunk and document with one DELETE statement per table.
+
+        QuerySet.delete() would first collect the documents to cascade to their
+        chunks; deleting the chunks first makes the cascade unnecessary.
+        """
+        deleted = {}
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in (Chunk, Document):
+                table = connection.ops.quote_name(model._meta.db_table)
+                cursor.execute(f"DELETE FROM {table}")
+                deleted[model.__name__] = cursor.rowcount
+        return deleted
+
+    def save_document(self, fields, chunks, batch_size, document=None):
+        """
+        Writes a document and its (page number, text) chunks in one transaction.
+
+        Chunks are consumed lazily and inserted batch_size at a time, so memory
+        stays bounded however long the document is. When `document` is given
+        (the file at its path changed), it is updated in place and its old
+        chunks are replaced. Returns the number of chunks written.
+        """
+        written = 0
+        with transaction.atomic():
+            if document is None:
+                document = Document.objects.create(**fields)
             else:
-                chunks.append(current_chunk.strip())
-                current_chunk = para + "\n\n"
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-        return chunks
+                for name, value in fields.items():
+                    setattr(document, name, value)
+                document.save()
+                document.chunks.all().delete()
+
+            chunks = iter(chunks)
+            while True:
+                batch = [
+                    Chunk(
+                        document=document,
+                        chunk_text=chunk_text,
+                        chunk_order=written + idx + 1,
+                        page_number=page_number,
+                    )
+                    for idx, (page_number, chunk_text) in enumerate(
+                        islice(chunks, batch_size)
+                    )
+                ]
+                if not batch:
+                    break
+                Chunk.objects.bulk_create(batch)
+                written += len(batch)
+        return written
+
+    def plan_imports(self, url_to_source_map, purge):
+        """
+        Compares the PDFs on disk with the imported documents.
+
+        Returns {file_path: (fields, existing document or None)} for the files
+        that need extracting, plus counts of the files that did not. Files whose
+        size and mtime match their document are skipped without being opened.
+        Renamed or moved files are recognised by their SHA-256 and relinked
+        without extraction.
+        """
+        documents = [] if purge else list(Document.objects.all())
+        by_path = {doc.file_path: doc for doc in documents}
+        by_hash = {}
+        for doc in documents:
+            if doc.content_sha256:
+                by_hash.setdefault(doc.content_sha256, []).append(doc)
+
+        plans = {}
+        counts = {"unchanged": 0, "relinked": 0, "changed": 0, "new": 0}
+        for root, dirs, files in os.walk(BASE_FOLDER):
+            for filename in files:
+                if not filename.lower().endswith(".pdf"):
+                    continue
+                file_path = os.path.join(root, filename)
+                stat = os.stat(file_path)
+
+                doc = by_path.get(file_path)
+                if (
+                    doc is not None
+                    and doc.file_size == stat.st_size
+                    and doc.file_mtime == stat.st_mtime
+                ):
+                    counts["unchanged"] += 1
+                    continue
+
+                # Normalize the local filename before looking it up
+                source_data = url_to_source_map.get(normalize_filename(filename))
+                fields = {
+                    "title": (
+                        source_data.get("title", filename) if source_data else filename
+                    ),
+                    "file_path": file_path,
+                    "source_url": source_data.get("url", "") if source_data else "",
+                    "file_size": stat.st_size,
+                    "file_mtime": stat.st_mtime,
+                    "content_sha256": file_sha256(file_path),
+                }
+
+                if doc is not None and doc.content_sha256 in (
+                    "",
+                    fields["content_sha256"],
+                ):
+                    # Same content (or imported before fingerprints were
+                    # recorded): just remember the fingerprint
+                    Document.objects.filter(pk=doc.pk).update(
+                        file_size=stat.st_size,
+                        file_mtime=stat.st_mtime,
+                        content_sha256=fields["content_sha256"],
+                    )
+                    self.stdout.write(
+                        self.style.NOTICE(f"Document already imported: {file_path}")
+                    )
+                    counts["unchanged"] += 1
+                    continue
+
+                if doc is None:
+                    moved = next(
+                        (
+                            candidate
+                            for candidate in by_hash.get(fields["content_sha256"], [])
+                            if not os.path.exists(candidate.file_path)
+                        ),
+                        None,
+                    )
+                    if moved is not None:
+                        self.stdout.write(
+                            self.style.NOTICE(
+                                f"Relinking {moved.file_path} -> {file_path}"
+                            )
+                        )
+                        Document.objects.filter(pk=moved.pk).update(**fields)
+                        moved.file_path = file_path
+                        counts["relinked"] += 1
+                        continue
+
+                counts["changed" if doc is not None else "new"] += 1
+                plans[file_path] = (fields, doc)
+        return plans, counts
+
+    def chunking_config(self, options):
+        """RAG_CHUNKING overridden by any chunking options given on the command line."""
+        config = {**DEFAULT_CONFIG, **getattr(settings, "RAG_CHUNKING", {})}
+        overrides = {
+            "STRATEGY": options["chunker"],
+            "CHUNK_TOKENS": options["chunk_tokens"],
+            "OVERLAP_TOKENS": options["overlap_tokens"],
+            "MAX_TOKENS": options["max_tokens"],
+        }
+        config.update(
+            {name: value for name, value in overrides.items() if value is not None}
+        )
+        try:
+            get_chunker(config)
+        except ValueError as e:
+            raise CommandError(str(e))
+        return config
+
+    def extract_pdfs(self, file_paths, workers, timeout, chunking):
+        """
+        Yields the process_pdf result of every file, in completion order.
+
+        With more than one worker, PDFs are extracted and chunked in a process
+        pool and each result is handed back as soon as it is ready, so the main
+        process can write it to the database while other files are still parsed.
+        """
+        if workers <= 1:
+            for file_path in file_paths:
+                yield process_pdf(file_path, timeout, chunking)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(process_pdf, file_path, timeout, chunking): file_path
+                for file_path in file_paths
+            }
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # The worker process died (e.g. the PDF crashed the parser)
+                    yield {
+                        "file_path": futures[future],
+                        "chunks": [],
+                        "pages": 0,
+                        "stats": ChunkStats(),
+                        "error": f"Worker failed on '{futures[future]}': {e}",
+                        "seconds": 0.0,
+                    }
 
     def handle(self, *args, **kwargs):
+        chunking = self.chunking_config(kwargs)
+
         if kwargs["purge_and_reimport"]:  # Corrected key
             self.stdout.write(
                 self.style.WARNING("Purging all existing documents and chunks...")
             )
-            Chunk.objects.all().delete()
-            Document.objects.all().delete()
-            self.stdout.write(self.style.SUCCESS("Purge complete."))
+            started = time.perf_counter()
+            deleted = self.purge()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Purge complete: deleted {deleted['Chunk']} chunks and "
+                    f"{deleted['Document']} documents in "
+                    f"{time.perf_counter() - started:.2f}s."
+                )
+            )
 
         self.stdout.write("Creating URL to source mapping...")
         url_to_source_map = create_url_mapping(SOURCES_JSON_PATH)
@@ -112,49 +317,85 @@ class Command(BaseCommand):
                 self.style.ERROR("No source data found. Proceeding without citations.")
             )
 
-        for root, dirs, files in os.walk(BASE_FOLDER):
-            for filename in files:
-                if filename.lower().endswith(".pdf"):
-                    file_path = os.path.join(root, filename)
+        # Find the files to import first, so that only new or changed files
+        # are extracted
+        plans, counts = self.plan_imports(
+            url_to_source_map, kwargs["purge_and_reimport"]
+        )
+        self.stdout.write(
+            f"{counts['new']} new, {counts['changed']} changed, "
+            f"{counts['relinked']} moved and {counts['unchanged']} unchanged PDFs."
+        )
+        file_paths = list(plans)
 
-                    self.stdout.write(f"\nProcessing document: {file_path}")
+        imported_documents = 0
+        total_pages = 0
+        written_rows = 0
+        write_seconds = 0.0
+        chunk_stats = ChunkStats()
+        started = time.perf_counter()
+        results = self.extract_pdfs(
+            file_paths, kwargs["workers"], kwargs["timeout"], chunking
+        )
+        for done, result in enumerate(results, start=1):
+            file_path = result["file_path"]
+            filename = os.path.basename(file_path)
+            total_pages += result["pages"]
 
-                    # Normalize the local filename before looking it up
-                    normalized_filename = normalize_filename(filename)
-                    source_data = url_to_source_map.get(normalized_filename)
+            self.stdout.write(
+                f"\n[{done}/{len(file_paths)}] Processing document: {file_path} "
+                f"({result['pages']} pages in {result['seconds']:.1f}s)"
+            )
+            if result["error"]:
+                self.stdout.write(self.style.WARNING(result["error"]))
+                continue
 
-                    doc_title = (
-                        source_data.get("title", filename) if source_data else filename
-                    )
-                    doc_url = source_data.get("url", "") if source_data else ""
+            if not result["chunks"]:
+                self.stdout.write(self.style.WARNING("No text extracted; skipping."))
+                os.remove(result["spool"])
+                continue
 
-                    if (
-                        not kwargs["purge_and_reimport"]
-                        and Document.objects.filter(file_path=file_path).exists()
-                    ):  # Corrected key
-                        self.stdout.write(
-                            self.style.NOTICE(f"Document already imported: {file_path}")
-                        )
-                        continue
+            self.stdout.write(f"Extracted {result['chunks']} chunks")
+            chunk_stats.update(result["stats"])
 
-                    text = self.extract_text_from_pdf(file_path)
-                    if not text:
-                        self.stdout.write(
-                            self.style.WARNING("No text extracted; skipping.")
-                        )
-                        continue
+            fields, document = plans[file_path]
+            write_started = time.perf_counter()
+            try:
+                written = self.save_document(
+                    fields, read_spool(result["spool"]), kwargs["batch_size"], document
+                )
+            finally:
+                os.remove(result["spool"])
+            write_seconds += time.perf_counter() - write_started
+            written_rows += written + 1
+            imported_documents += 1
 
-                    doc = Document.objects.create(
-                        title=doc_title, file_path=file_path, source_url=doc_url
-                    )
-                    chunks = self.chunk_text(text)
-                    self.stdout.write(f"Extracted {len(chunks)} chunks")
+            self.stdout.write(
+                self.style.SUCCESS(f"Saved document and chunks for: {filename}")
+            )
 
-                    for idx, chunk_text in enumerate(chunks):
-                        Chunk.objects.create(
-                            document=doc, chunk_text=chunk_text, chunk_order=idx + 1
-                        )
+        elapsed = time.perf_counter() - started
+        if file_paths:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"\nExtracted {total_pages} pages from {len(file_paths)} PDFs in "
+                    f"{elapsed:.1f}s ({total_pages / max(elapsed, 1e-9):.1f} pages/sec, "
+                    f"{kwargs['workers']} worker(s))."
+                )
+            )
+        if chunk_stats.chunks:
+            self.stdout.write(
+                f"Chunking ({chunking['STRATEGY']}): " + "\n".join(chunk_stats.report())
+            )
+        if written_rows:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Wrote {written_rows} rows for {imported_documents} documents "
+                    f"in {write_seconds:.2f}s "
+                    f"({written_rows / max(write_seconds, 1e-9):.0f} rows/sec)."
+                )
+            )
 
-                    self.stdout.write(
-                        self.style.SUCCESS(f"Saved document and chunks for: {filename}")
-                    )
+        # Cached answers were built from the previous corpus
+        if kwargs["purge_and_reimport"] or imported_documents or counts["relinked"]:
+            invalidate_answer_cache()
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_app", "0002_document_source_url"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="content_sha256",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="file_mtime",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="file_size",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_app", "0003_document_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chunk",
+            name="page_number",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -5,6 +5,11 @@ class Document(models.Model):
     title = models.CharField(max_length=255)
     file_path = models.CharField(max_length=500)
     source_url = models.URLField(null=True, blank=True)
+    # Fingerprint of the imported file, used by import_pdfs to skip unchanged
+    # files and to recognise moved ones without extracting them again
+    file_size = models.BigIntegerField(null=True, blank=True)
+    file_mtime = models.FloatField(null=True, blank=True)
+    content_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -17,6 +22,8 @@ class Chunk(models.Model):
     )
     chunk_text = models.TextField()
     chunk_order = models.IntegerField()
+    # PDF page (from 1) where the chunk starts, for citations
+    page_number = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
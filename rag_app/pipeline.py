@@ -0,0 +1,349 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from rag_app import resources
+from rag_app.context_packing import pack_contexts
+from rag_app.fusion import fuse_scores, parse_fusion_options
+from rag_app.instrumentation import ANSWER_CACHE_LOOKUPS, stage
+from rag_app.llm import GENERATION_ERROR_ANSWERS, PROMPT_VERSION, generate_answer
+
+MODES = ("baseline", "reranker", "cross")
+
+# Label of mode "cross" answers ranked without the cross-encoder (not cached)
+CROSS_FALLBACK_LABEL = "hybrid-fallback"
+
+# Bounded pool for the CPU-bound search stage of async requests, so a burst of
+# concurrent questions queues here instead of spawning a thread per request
+search_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "RAG_SEARCH_EXECUTOR_WORKERS", 4),
+    thread_name_prefix="rag-search",
+)
+
+# First-stage retrieval of the hybrid modes: BM25 top-N runs in these threads
+# while the dense search runs in the request thread, and both candidate lists
+# are merged before fusion. DENSE_DEPTH 0 keeps the default of k * 2 and
+# LEXICAL_DEPTH 0 turns the lexical retriever off.
+_hybrid_config = {
+    "DENSE_DEPTH": 0,
+    "LEXICAL_DEPTH": 20,
+    "THREADS": 4,
+    **getattr(settings, "RAG_HYBRID_RETRIEVAL", {}),
+}
+lexical_executor = ThreadPoolExecutor(
+    max_workers=_hybrid_config["THREADS"], thread_name_prefix="rag-lexical"
+)
+
+# How the ranked chunks are packed into the prompt (see rag_app/context_packing.py)
+_context_packing_config = getattr(settings, "RAG_CONTEXT_PACKING", {})
+
+
+def _positive_int(data, name, default=None, maximum=None):
+    """Reads an optional positive integer (or integer string) from a request body."""
+    value = data.get(name, default)
+    if value is None:
+        return None
+    try:
+        # Neither booleans nor fractions are silently turned into a count
+        if isinstance(value, bool) or (
+            isinstance(value, float) and not value.is_integer()
+        ):
+            raise ValueError
+        value = int(value)
+    except (TypeError, ValueError):
+        value = 0
+    if value < 1:
+        raise ValueError(f"'{name}' must be a positive integer.")
+    if maximum is not None and value > maximum:
+        raise ValueError(f"'{name}' must be at most {maximum}.")
+    return value
+
+
+def parse_ask_request(data):
+    """
+    Validates an /ask request body and returns its options as a dict.
+
+    Raises ValueError (or TypeError) with a message meant for the client.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("The request body must be a JSON object with 'q'.")
+    query = data.get("q", "")
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("Query 'q' is required and must be a non-empty string.")
+
+    k = _positive_int(data, "k", 5, maximum=getattr(settings, "RAG_MAX_K", 50))
+    mode = data.get("mode", "baseline")
+    if mode not in MODES:
+        raise ValueError("Invalid mode. Use 'baseline', 'reranker' or 'cross'.")
+
+    fusion_method, fusion_weights = parse_fusion_options(data)
+
+    # Optional per-request FAISS search knobs for IVF (nprobe) and HNSW (ef_search)
+    search_knobs = {name: _positive_int(data, name) for name in ("nprobe", "ef_search")}
+
+    return {
+        "query": query,
+        "k": k,
+        "mode": mode,
+        "fusion": fusion_method,
+        "weights": fusion_weights,
+        **search_knobs,
+    }
+
+
+def search_settings(options):
+    return (options["nprobe"], options["ef_search"])
+
+
+def retrieval_depth(options):
+    """Number of FAISS candidates to retrieve for the request."""
+    # Retrieve more for reranking
+    depth = options["k"] * 2
+    if options["mode"] != "baseline":
+        depth = _hybrid_config["DENSE_DEPTH"] or depth
+    if options["mode"] == "cross" and resources.cross_reranker is not None:
+        depth = max(depth, resources.cross_reranker.depth)
+    return depth
+
+
+def cached_answer(options):
+    """Returns (cache key, cached payload or None) for the request options."""
+    answer_cache = resources.answer_cache
+    if answer_cache is None:
+        return None, None
+    cache_key = answer_cache.key(
+        options["query"],
+        {name: value for name, value in options.items() if name != "query"},
+        PROMPT_VERSION,
+        resources.corpus_version,
+    )
+    cached_response = answer_cache.get(cache_key)
+    ANSWER_CACHE_LOOKUPS.inc(result="miss" if cached_response is None else "hit")
+    return cache_key, cached_response
+
+
+def store_answer(cache_key, response_data):
+    # A fallback ranking must not be served for later cross-encoder requests
+    if cache_key is not None and response_data["reranker_used"] != CROSS_FALLBACK_LABEL:
+        resources.answer_cache.set(cache_key, response_data)
+
+
+def answer_from_contexts(options, contexts, reranker_used_label, cache_key):
+    """Step 5: generates the answer, builds the response payload and caches it."""
+    answer, citations = generate_answer(options["query"], contexts)
+    response_data = {
+        "answer": answer,
+        "contexts": contexts,
+        "citations": citations,
+        "reranker_used": reranker_used_label,
+    }
+    if answer not in GENERATION_ERROR_ANSWERS:
+        store_answer(cache_key, response_data)
+    return response_data
+
+
+def search_candidates(options):
+    """Step 1: encode the query and search FAISS (coalesced with other requests if enabled)."""
+    return resources.search_index(
+        options["query"], retrieval_depth(options), search_settings(options)
+    )
+
+
+def start_lexical_search(options):
+    """
+    Starts the BM25 top-N search of a hybrid-mode request in a lexical thread.
+
+    Returns a future of (rows, BM25 scores), or None when it does not apply.
+    """
+    if options["mode"] == "baseline" or not _hybrid_config["LEXICAL_DEPTH"]:
+        return None
+    # Run in a copy of the caller's context so stage timings reach its request
+    context = contextvars.copy_context()
+    return lexical_executor.submit(
+        context.run, lexical_search, options["query"], _hybrid_config["LEXICAL_DEPTH"]
+    )
+
+
+def lexical_search(query, depth):
+    with stage("lexical_search"):
+        return resources.bm25_index.top_k(query, depth)
+
+
+def merge_candidates(query, rows, distances, lexical_rows, lexical_scores):
+    """
+    Unions the dense and lexical candidates; returns (rows, L2 distances, BM25 scores).
+
+    Dense candidates get their BM25 score from the postings. Lexical-only
+    candidates were not in the dense top-N, so they are at least as far from
+    the query as the farthest dense hit; that distance stands in for theirs.
+    """
+    bm25_scores = resources.bm25_index.get_batch_scores(query, rows)
+    extra = ~np.isin(lexical_rows, rows)
+    farthest = distances.max() if len(distances) else 0.0
+    return (
+        np.concatenate([rows, lexical_rows[extra]]),
+        np.concatenate([distances, np.full(extra.sum(), farthest)]),
+        np.concatenate([bm25_scores, lexical_scores[extra]]),
+    )
+
+
+def rank_rows(options, distances, faiss_ids, lexical_search=None):
+    """
+    Resolves the FAISS hits and ranks them for the requested mode.
+
+    `lexical_search` is the future returned by start_lexical_search, if any.
+    Returns (chunk-store rows, scores, reranker label), best first.
+    """
+    query, mode = options["query"], options["mode"]
+
+    # Step 2: Resolve FAISS rows to chunks with a vectorized gather over the chunk store
+    rows, hit_positions = resources.chunk_store.valid_rows(faiss_ids[0])
+    semantic_scores = distances[0][hit_positions]
+
+    # Check if the user wants to use the reranker
+    if mode in ("reranker", "cross"):
+        # Step 3: Score the FAISS candidates with BM25, adding the BM25 top-N
+        # candidates when the lexical retriever ran alongside the dense one
+        with stage("lexical"):
+            if lexical_search is not None:
+                rows, semantic_scores, bm25_scores = merge_candidates(
+                    query, rows, semantic_scores, *lexical_search.result()
+                )
+            else:
+                bm25_scores = resources.bm25_index.get_batch_scores(query, rows)
+
+        # Step 4: Normalize and blend semantic and keyword scores
+        with stage("fusion"):
+            blended_scores = fuse_scores(
+                semantic_scores, bm25_scores, options["fusion"], options["weights"]
+            )
+            # Sort by the new blended score
+            order = np.argsort(-blended_scores, kind="stable")
+        if mode == "cross":
+            return cross_rerank(query, rows[order], blended_scores[order])
+        return rows[order], blended_scores[order], "hybrid"
+
+    # Baseline mode: keep the FAISS order
+    return rows, semantic_scores, "baseline"
+
+
+def cross_rerank(query, rows, hybrid_scores):
+    """
+    Step 4b: rescores the top hybrid candidates with the cross-encoder.
+
+    Keeps the hybrid ranking, labeled as a fallback, when the cross-encoder is
+    disabled, not loaded yet, failing, or slower than its latency budget.
+    """
+    reranker = resources.cross_reranker
+    if reranker is None:
+        return rows, hybrid_scores, CROSS_FALLBACK_LABEL
+    candidates = rows[: reranker.depth]
+    with stage("cross_encoder"):
+        scores = reranker.score(query, resources.chunk_store.texts(candidates))
+    if scores is None:
+        return rows, hybrid_scores, CROSS_FALLBACK_LABEL
+    order = np.argsort(-scores, kind="stable")
+    return candidates[order], scores[order], "cross"
+
+
+def select_contexts(rows, scores, reranker_used_label, max_contexts):
+    """
+    Builds the contexts passed to the LLM from the ranked rows.
+
+    At most `max_contexts` chunks are packed, within the prompt token budget so
+    that the context window of the LLM does not overflow.
+    """
+    with stage("contexts"):
+        return pack_contexts(
+            resources.chunk_store,
+            rows,
+            scores,
+            reranker_used_label,
+            max_contexts,
+            _context_packing_config,
+        )
+
+
+def rank_candidates(options, distances, faiss_ids, lexical_search=None):
+    """
+    Ranks the first-stage candidates for the requested mode.
+
+    Returns the contexts to pass to the LLM and the reranker label for the response.
+    """
+    rows, scores, reranker_used_label = rank_rows(
+        options, distances, faiss_ids, lexical_search
+    )
+    contexts = select_contexts(rows, scores, reranker_used_label, options["k"])
+    return contexts, reranker_used_label
+
+
+def retrieve_contexts(options):
+    """Runs the search stage for one question; returns (contexts, reranker label)."""
+    lexical_search = start_lexical_search(options)
+    distances, faiss_ids = search_candidates(options)
+    return rank_candidates(options, distances, faiss_ids, lexical_search)
+
+
+def retrieve_contexts_batch(options_list):
+    """
+    Runs the search stage for many questions at once.
+
+    All queries are encoded in one call and FAISS is searched with one matrix
+    query per distinct search setting; each question then gets its own
+    (contexts, reranker label).
+    """
+    if not options_list:
+        return []
+    lexical_searches = [start_lexical_search(options) for options in options_list]
+    with stage("encode"):
+        embeddings = resources.encode_queries(
+            [options["query"] for options in options_list]
+        )
+    with stage("faiss"):
+        distances, faiss_ids = resources.search_embeddings(
+            embeddings,
+            max(retrieval_depth(options) for options in options_list),
+            [search_settings(options) for options in options_list],
+        )
+    results = []
+    for i, (options, lexical_search) in enumerate(zip(options_list, lexical_searches)):
+        depth = retrieval_depth(options)
+        results.append(
+            rank_candidates(
+                options,
+                distances[i : i + 1, :depth],
+                faiss_ids[i : i + 1, :depth],
+                lexical_search,
+            )
+        )
+    return results
+
+
+async def run_in_search_executor(func, *args):
+    # Run in a copy of the caller's context so stage timings reach its request
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        search_executor, context.run, func, *args
+    )
+
+
+async def aretrieve_contexts(options):
+    """
+    Runs retrieve_contexts (encode, FAISS and BM25) in the bounded search executor.
+
+    With micro-batching on, the request waits on the batcher directly instead of
+    holding an executor thread, so concurrent async requests can share a batch.
+    """
+    if resources.micro_batcher is None:
+        return await run_in_search_executor(retrieve_contexts, options)
+    lexical_search = start_lexical_search(options)
+    distances, faiss_ids = await asyncio.wrap_future(
+        resources.micro_batcher.submit(
+            options["query"], retrieval_depth(options), search_settings(options)
+        )
+    )
+    return await run_in_search_executor(
+        rank_candidates, options, distances, faiss_ids, lexical_search
+    )
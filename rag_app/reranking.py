@@ -0,0 +1,218 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+from rag_app.instrumentation import CROSS_ENCODER_FALLBACKS
+
+
+class _PendingScoring:
+    __slots__ = ("query", "texts", "future", "deadline")
+
+    def __init__(self, query, texts, deadline):
+        self.query = query
+        self.texts = texts
+        self.future = Future()
+        self.deadline = deadline
+
+
+class CrossEncoderReranker:
+    """
+    Scores (query, chunk) pairs with a local cross-encoder within a latency budget.
+
+    Cached pair scores are returned right away. The remaining pairs are queued
+    for a single scoring thread, so concurrent requests do not oversubscribe
+    the CPU: each batch takes every request waiting at that point and scores
+    their pairs in one batched forward pass. Every request waits until its own
+    deadline; if its scores are not ready by then, score() returns None and the
+    caller keeps its first-stage ranking. A request that is still queued at its
+    deadline is dropped, so the queue never holds work nobody waits for; one
+    already being scored finishes and fills the cache. While a batch has run
+    longer than the whole budget, new requests fall back at once.
+
+    The model is loaded on the scoring thread on first use, so server start-up
+    and readiness do not wait for it; requests fall back until it is loaded.
+    """
+
+    def __init__(
+        self,
+        model_name,
+        depth=20,
+        max_length=256,
+        batch_size=32,
+        budget_ms=1000,
+        cache=None,
+    ):
+        self.model_name = model_name
+        # Number of first-stage candidates to rescore
+        self.depth = depth
+        # Each (query, chunk) pair is truncated to this many tokens
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.budget = budget_ms / 1000.0
+        self.cache = cache
+
+        self.model = None
+        self.load_error = None
+        self._load_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        # When the batch being scored started, or None while idle
+        self._batch_started = None
+
+        # Metrics
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        # Requests dropped without being scored: queued past their deadline, or
+        # turned away while a batch was over budget
+        self.dropped_jobs = 0
+
+    def _load(self):
+        with self._load_lock:
+            if self.model is None and self.load_error is None:
+                try:
+                    self.model = CrossEncoder(
+                        self.model_name, max_length=self.max_length
+                    )
+                    print(f"Cross-encoder {self.model_name} loaded.")
+                except Exception as e:
+                    self.load_error = f"Failed to load cross-encoder: {e}"
+                    print(self.load_error)
+        if self.model is None:
+            raise RuntimeError(self.load_error)
+        return self.model
+
+    def _predict(self, pairs):
+        scores = self._load().predict(
+            pairs,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        scores = np.asarray(scores, dtype=np.float32).reshape(len(pairs))
+        if self.cache is not None:
+            for (query, text), score in zip(pairs, scores):
+                self.cache.set(query, text, float(score))
+        return scores
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="rag-cross-encoder", daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self):
+        """Blocks for the first live request, then takes every other one waiting."""
+        batch = []
+        while not batch:
+            pending = [self._queue.get()]
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            now = time.monotonic()
+            for item in pending:
+                # The caller has given up or is about to; a caller that gave
+                # up first has cancelled and counted the request itself
+                if item.deadline <= now and item.future.cancel():
+                    self._count_dropped()
+                if item.future.set_running_or_notify_cancel():
+                    batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._batch_started = time.monotonic()
+            pairs = list(
+                dict.fromkeys(
+                    (item.query, text) for item in batch for text in item.texts
+                )
+            )
+            try:
+                scores = dict(zip(pairs, self._predict(pairs)))
+            except Exception as e:
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+            finally:
+                self._batch_started = None
+                with self._stats_lock:
+                    self.batches += 1
+            for item in batch:
+                item.future.set_result(
+                    np.array(
+                        [scores[(item.query, text)] for text in item.texts],
+                        dtype=np.float32,
+                    )
+                )
+
+    def _count_dropped(self):
+        with self._stats_lock:
+            self.dropped_jobs += 1
+
+    def score(self, query, texts):
+        """Returns one score per text (higher is better), or None to fall back."""
+        scores = np.empty(len(texts), dtype=np.float32)
+        missing = []
+        for i, text in enumerate(texts):
+            cached = self.cache.get(query, text) if self.cache is not None else None
+            if cached is None:
+                missing.append(i)
+            else:
+                scores[i] = cached
+        if not missing:
+            return scores
+
+        if self.load_error is not None:
+            CROSS_ENCODER_FALLBACKS.inc(reason="error")
+            return None
+
+        # A batch that has already used up a whole budget will not finish in
+        # time for a request queued behind it
+        now = time.monotonic()
+        batch_started = self._batch_started
+        if batch_started is not None and now - batch_started > self.budget:
+            self._count_dropped()
+            CROSS_ENCODER_FALLBACKS.inc(reason="overloaded")
+            return None
+
+        self._ensure_worker()
+        pending = _PendingScoring(query, [texts[i] for i in missing], now + self.budget)
+        self._queue.put(pending)
+        try:
+            scores[missing] = pending.future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            # Drops the request if it is still queued; a batch already scoring
+            # it finishes and fills the cache
+            if pending.future.cancel():
+                self._count_dropped()
+            CROSS_ENCODER_FALLBACKS.inc(reason="timeout")
+            return None
+        except Exception as e:
+            print(f"Error during cross-encoder scoring: {e}")
+            CROSS_ENCODER_FALLBACKS.inc(reason="error")
+            return None
+        return scores
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "model": self.model_name,
+                "loaded": self.model is not None,
+                "error": self.load_error,
+                "batches": self.batches,
+                "queued": self._queue.qsize(),
+                "dropped_jobs": self.dropped_jobs,
+                "cache": self.cache.stats() if self.cache is not None else None,
+            }
@@ -0,0 +1,398 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from sentence_transformers import SentenceTransformer
+
+from rag_app.artifacts import (
+    StaleArtifactsError,
+    current_corpus_version,
+    load_artifacts,
+)
+from rag_app.batching import MicroBatcher
+from rag_app.bm25 import BM25Index
+from rag_app.cache import (
+    AnswerCache,
+    PairScoreCache,
+    QueryEmbeddingCache,
+    build_backend,
+)
+from rag_app.chunk_store import ChunkStore
+from rag_app.instrumentation import RESOURCE_LOAD_SECONDS, stage
+from rag_app.reranking import CrossEncoderReranker
+from rag_app.vector_index import (
+    DEFAULT_SEARCH_CONFIG,
+    is_keyed_by_id,
+    search_parameters,
+)
+
+# Define the paths for the generated files (must match embed_chunks.py)
+EMBEDDINGS_DIR = "embeddings"
+INDEX_FILE = os.path.join(EMBEDDINGS_DIR, "chunks.index")
+MAPPING_FILE = os.path.join(EMBEDDINGS_DIR, "chunk_id_map.json")
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Global variables for all search resources
+model = None
+faiss_index = None
+chunk_store = None
+bm25_index = None
+corpus_version = None
+
+# Bounded cache of query embeddings, shared by every request in this process
+# (or by every worker when backed by Django's cache framework)
+_query_cache_config = getattr(settings, "RAG_QUERY_EMBEDDING_CACHE", {})
+query_embedding_cache = (
+    QueryEmbeddingCache(
+        MODEL_NAME, build_backend(_query_cache_config, prefix="rag:query-embedding")
+    )
+    if _query_cache_config.get("ENABLED", True)
+    else None
+)
+
+# Cache of complete /ask responses, invalidated by import_pdfs and embed_chunks
+_answer_cache_config = getattr(settings, "RAG_ANSWER_CACHE", {})
+answer_cache = (
+    AnswerCache(build_backend(_answer_cache_config, prefix="rag:answer"))
+    if _answer_cache_config.get("ENABLED", True)
+    else None
+)
+
+# Load state reported by the readiness endpoint, keyed by resource name
+load_status = {}
+_ready = False
+_load_lock = threading.Lock()
+
+
+class ResourceError(Exception):
+    """Raised by a loader with a message that is safe to return to API clients."""
+
+
+def _load_model():
+    global model
+    try:
+        loaded = SentenceTransformer(MODEL_NAME)
+    except Exception as e:
+        raise ResourceError(f"Failed to load Sentence Transformer model: {e}")
+    # A dummy encode initializes the tokenizer and warms the inference kernels
+    loaded.encode(["warm-up"], convert_to_numpy=True)
+    model = loaded
+    print("Sentence Transformer model loaded.")
+
+
+def _load_faiss_index():
+    global faiss_index
+    if not os.path.exists(INDEX_FILE) or not os.path.exists(MAPPING_FILE):
+        raise ResourceError(
+            "Embeddings not found. Please run `python manage.py embed_chunks` first."
+        )
+    try:
+        faiss_index = faiss.read_index(INDEX_FILE)
+    except Exception as e:
+        raise ResourceError(f"Failed to load FAISS index: {e}")
+    print("FAISS index loaded.")
+
+
+def _load_lexical_index():
+    """Loads the chunk store and BM25 index, preferring the memory-mapped artifacts."""
+    global chunk_store, bm25_index, corpus_version
+
+    # The warm-up may start while Django is still populating the app registry;
+    # wait for it so that the database is not queried during app initialization.
+    while not apps.ready:
+        time.sleep(0.01)
+
+    store, lexical_index, version = None, None, None
+    try:
+        artifacts = load_artifacts(
+            EMBEDDINGS_DIR,
+            verify_checksums=getattr(settings, "RAG_VERIFY_ARTIFACT_CHECKSUMS", True),
+        )
+        store, lexical_index = artifacts.chunk_store, artifacts.bm25_index
+        version = artifacts.corpus_version
+        print(f"Search artifacts mapped (corpus version {version}).")
+    except FileNotFoundError:
+        print("Search artifacts not found; building them from the database.")
+    except StaleArtifactsError as e:
+        print(
+            f"Ignoring stale search artifacts ({e}). "
+            "Run `python manage.py embed_chunks` to refresh them."
+        )
+
+    # Otherwise build the chunk store from the ID map and the database
+    if store is None:
+        try:
+            with open(MAPPING_FILE, "r") as f:
+                chunk_id_map = json.load(f)
+            row_chunk_ids = np.full(len(chunk_id_map), -1, dtype=np.int64)
+            for faiss_id, chunk_db_id in chunk_id_map.items():
+                row_chunk_ids[int(faiss_id)] = chunk_db_id
+            version = current_corpus_version()
+            store = ChunkStore.from_database(row_chunk_ids)
+            print(f"Chunk store built with {len(store)} rows.")
+        except FileNotFoundError:
+            raise ResourceError(
+                "Embeddings not found. Please run `python manage.py embed_chunks` first."
+            )
+        except Exception as e:
+            raise ResourceError(f"Failed to build the chunk store: {e}")
+
+    if not (store.ids >= 0).any():
+        raise ResourceError(
+            "No chunks found in the database. Please run `import_pdfs` first."
+        )
+
+    # Build the BM25 index over the chunk store so its rows match the FAISS rows
+    if lexical_index is None:
+        try:
+            lexical_index = BM25Index.build(
+                store.text(row) for row in range(len(store))
+            )
+            print("BM25 index created.")
+        except Exception as e:
+            raise ResourceError(f"Failed to create BM25 index: {e}")
+
+    chunk_store, bm25_index, corpus_version = store, lexical_index, version
+
+
+LOADERS = {
+    "model": _load_model,
+    "faiss_index": _load_faiss_index,
+    "lexical_index": _load_lexical_index,
+}
+
+
+def _run_loader(name):
+    """Runs one loader in a worker thread and records whether and how fast it loaded."""
+    started = time.perf_counter()
+    try:
+        LOADERS[name]()
+        load_status[name] = {"loaded": True, "error": None}
+    except ResourceError as e:
+        load_status[name] = {"loaded": False, "error": str(e)}
+    except Exception as e:
+        load_status[name] = {"loaded": False, "error": f"Failed to load {name}: {e}"}
+    finally:
+        load_status[name]["seconds"] = round(time.perf_counter() - started, 3)
+        RESOURCE_LOAD_SECONDS.set(load_status[name]["seconds"], resource=name)
+        # Worker threads get their own DB connections; don't leak them
+        connections.close_all()
+
+
+def load_resources():
+    """
+    Loads the model, FAISS index and lexical index concurrently.
+
+    Returns (success, error message). Safe to call on every request: once all
+    resources are loaded this is a single flag check.
+    """
+    global _ready
+    if _ready:
+        return True, ""
+
+    with _load_lock:
+        if _ready:
+            return True, ""
+
+        pending = [
+            name
+            for name in LOADERS
+            if not load_status.get(name, {}).get("loaded", False)
+        ]
+        with ThreadPoolExecutor(
+            max_workers=len(pending), thread_name_prefix="rag-warmup"
+        ) as pool:
+            list(pool.map(_run_loader, pending))
+
+        for name in LOADERS:
+            if not load_status[name]["loaded"]:
+                return False, load_status[name]["error"]
+
+        if len(chunk_store) != faiss_index.ntotal:
+            load_status["lexical_index"]["loaded"] = False
+            return (
+                False,
+                f"The chunk store has {len(chunk_store)} rows but the FAISS index has "
+                f"{faiss_index.ntotal}. Please run `python manage.py embed_chunks`.",
+            )
+
+        _ready = True
+        return True, ""
+
+
+def encode_queries(queries):
+    """
+    Returns the (n, dim) embeddings of several queries.
+
+    Cached embeddings are reused and all cache misses are encoded in one batch.
+    """
+    if query_embedding_cache is None:
+        return model.encode(queries, convert_to_numpy=True)
+
+    embeddings = [query_embedding_cache.get(query) for query in queries]
+    missing = list(dict.fromkeys(q for q, e in zip(queries, embeddings) if e is None))
+    if missing:
+        encoded = dict(zip(missing, model.encode(missing, convert_to_numpy=True)))
+        for query, embedding in encoded.items():
+            query_embedding_cache.set(query, embedding)
+        embeddings = [
+            encoded[q] if e is None else e for q, e in zip(queries, embeddings)
+        ]
+    return np.vstack(embeddings)
+
+
+def encode_query(query):
+    """Returns the (1, dim) embedding of a query, reusing cached embeddings when possible."""
+    return encode_queries([query])
+
+
+# Query-time accuracy/speed knobs for approximate FAISS indexes; requests may
+# override them. Flat indexes ignore both.
+_faiss_search_config = {
+    **DEFAULT_SEARCH_CONFIG,
+    **getattr(settings, "RAG_FAISS_SEARCH", {}),
+}
+
+
+def search_embeddings(query_embeddings, k, search_settings=None):
+    """
+    Searches FAISS for every row of query_embeddings.
+
+    search_settings optionally holds one (nprobe, ef_search) pair per row, with
+    None meaning the configured default. Rows sharing settings are searched together.
+    """
+    if search_settings is None:
+        search_settings = [(None, None)] * len(query_embeddings)
+
+    groups = {}
+    for row, row_settings in enumerate(search_settings):
+        groups.setdefault(tuple(row_settings or (None, None)), []).append(row)
+
+    distances = np.empty((len(query_embeddings), k), dtype=np.float32)
+    ids = np.empty((len(query_embeddings), k), dtype=np.int64)
+    for (nprobe, ef_search), rows in groups.items():
+        params = search_parameters(
+            faiss_index,
+            nprobe=nprobe or _faiss_search_config["NPROBE"],
+            ef_search=ef_search or _faiss_search_config["EF_SEARCH"],
+        )
+        distances[rows], ids[rows] = faiss_index.search(
+            query_embeddings[rows], k, params=params
+        )
+
+    # Indexes built by incremental embed_chunks return Chunk ids, not rows
+    if is_keyed_by_id(faiss_index):
+        ids = chunk_store.rows_for_ids(ids.ravel()).reshape(ids.shape)
+    return distances, ids
+
+
+# Coalesces concurrent encode + FAISS searches into batches when enabled
+_batching_config = getattr(settings, "RAG_MICRO_BATCHING", {})
+micro_batcher = (
+    MicroBatcher(
+        encode_queries,
+        search_embeddings,
+        max_batch_size=_batching_config.get("MAX_BATCH_SIZE", 32),
+        max_wait_ms=_batching_config.get("MAX_WAIT_MS", 5),
+    )
+    if _batching_config.get("ENABLED", False)
+    else None
+)
+
+
+# Second-stage reranker for mode "cross"; its model is loaded on first use
+_cross_encoder_config = {
+    "ENABLED": True,
+    "MODEL": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+    "CANDIDATES": 20,
+    "MAX_LENGTH": 256,
+    "BATCH_SIZE": 32,
+    "LATENCY_BUDGET_MS": 1000,
+    "CACHE_SIZE": 10000,
+    **getattr(settings, "RAG_CROSS_ENCODER", {}),
+}
+cross_reranker = (
+    CrossEncoderReranker(
+        _cross_encoder_config["MODEL"],
+        depth=_cross_encoder_config["CANDIDATES"],
+        max_length=_cross_encoder_config["MAX_LENGTH"],
+        batch_size=_cross_encoder_config["BATCH_SIZE"],
+        budget_ms=_cross_encoder_config["LATENCY_BUDGET_MS"],
+        cache=(
+            PairScoreCache(
+                _cross_encoder_config["MODEL"],
+                build_backend(
+                    {"MAX_SIZE": _cross_encoder_config["CACHE_SIZE"]},
+                    prefix="rag:pair-score",
+                ),
+            )
+            if _cross_encoder_config["CACHE_SIZE"]
+            else None
+        ),
+    )
+    if _cross_encoder_config["ENABLED"]
+    else None
+)
+
+
+def search_index(query, k, search_settings=None):
+    """Encodes one query and searches FAISS, returning (distances, ids) of shape (1, k)."""
+    if micro_batcher is not None:
+        # Encode and FAISS run in the batcher thread, together with other requests
+        with stage("search"):
+            return micro_batcher.search(query, k, search_settings)
+    with stage("encode"):
+        embedding = encode_query(query)
+    with stage("faiss"):
+        return search_embeddings(embedding, k, [search_settings])
+
+
+def batching_stats():
+    return micro_batcher.stats() if micro_batcher is not None else None
+
+
+def cache_stats():
+    stats = {}
+    if query_embedding_cache is not None:
+        stats["query_embedding"] = query_embedding_cache.stats()
+    if answer_cache is not None:
+        stats["answer"] = answer_cache.stats()
+    return stats
+
+
+def cross_encoder_stats():
+    return cross_reranker.stats() if cross_reranker is not None else None
+
+
+def warm_up():
+    """Loads every resource and runs one end-to-end search so the first request is fast."""
+    started = time.perf_counter()
+    success, error_msg = load_resources()
+    if not success:
+        print(f"Search warm-up failed: {error_msg}")
+        return
+    faiss_index.search(model.encode(["warm-up"], convert_to_numpy=True), 1)
+    load_status["warm_up"] = {
+        "loaded": True,
+        "error": None,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    print(f"Search resources warmed up in {load_status['warm_up']['seconds']}s.")
+
+
+def is_ready():
+    return _ready
+
+
+def start_warm_up():
+    """Starts the warm-up in a background thread so server startup is not blocked."""
+    thread = threading.Thread(target=warm_up, name="rag-warmup", daemon=True)
+    thread.start()
+    return thread
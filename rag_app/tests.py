@@ -1,3 +1,765 @@
-from django.test import TestCase
+import json
+import math
+import os
+import tempfile
+from collections import Counter
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import faiss
+import numpy as np
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from rag_app import resources
+from rag_app.artifacts import (
+    ARTIFACT_FORMAT_VERSION,
+    MANIFEST_NAME,
+    StaleArtifactsError,
+    current_corpus_version,
+    file_sha256,
+    load_artifacts,
+    read_manifest,
+    write_artifacts,
+)
+from rag_app.batching import MicroBatcher
+from rag_app.bm25 import BM25Index, tokenize
+from rag_app.cache import LocalLRUBackend
+from rag_app.chunk_store import ChunkStore
+from rag_app.chunking import Chunker, ChunkStats, get_chunker
+from rag_app.context_packing import pack_contexts
+from rag_app.embedding_store import HASHES_FILE, VECTORS_FILE, EmbeddingStore
+from rag_app.extraction import iter_paragraphs
+from rag_app.fusion import fuse_scores, parse_fusion_options
+from rag_app.management.commands import import_pdfs
+from rag_app.models import Chunk, Document
+from rag_app.pipeline import merge_candidates, parse_ask_request
+from rag_app.vector_index import content_hashes
+
+CORPUS = [
+    "Machine guarding protects workers from moving machine parts.",
+    "Lockout tagout isolates energy before maintenance.",
+    "Guards and interlocks: machine guarding in practice, guarding every machine.",
+    "ISO 13849 covers safety-related parts of control systems.",
+    "",
+]
+
+
+def reference_bm25(texts, query, k1=1.5, b=0.75):
+    """Okapi BM25 written out term by term, to check the vectorized index against."""
+    docs = [Counter(tokenize(text)) for text in texts]
+    lengths = [sum(doc.values()) for doc in docs]
+    avgdl = sum(lengths) / len(docs) or 1.0
+    scores = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        for term in tokenize(query):
+            df = sum(1 for other in docs if term in other)
+            if not df:
+                continue
+            idf = math.log(1.0 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = doc[term]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avgdl))
+        scores.append(score)
+    return np.array(scores)
+
+
+class BM25IndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = BM25Index.build(CORPUS)
+
+    def test_scores_match_reference(self):
+        for query in ("machine guarding", "guarding guarding", "ISO 13849", "nothing"):
+            with self.subTest(query=query):
+                expected = reference_bm25(CORPUS, query)
+                np.testing.assert_allclose(
+                    self.index.get_scores(query), expected, rtol=1e-5
+                )
+                np.testing.assert_allclose(
+                    self.index.get_batch_scores(query, [4, 2, 0]),
+                    expected[[4, 2, 0]],
+                    rtol=1e-5,
+                )
+
+    def test_top_k_is_best_first(self):
+        expected = reference_bm25(CORPUS, "machine guarding")
+        rows, scores = self.index.top_k("machine guarding", 2)
+        self.assertEqual(rows.tolist(), np.argsort(-expected)[:2].tolist())
+        np.testing.assert_allclose(scores, np.sort(expected)[::-1][:2], rtol=1e-5)
+
+    def test_top_k_without_matches(self):
+        rows, scores = self.index.top_k("unknown words", 3)
+        self.assertEqual(len(rows), 0)
+        self.assertEqual(len(scores), 0)
+
+
+class ChunkerTests(SimpleTestCase):
+    PARAGRAPHS = [(1, "one two three"), (1, "four five six"), (2, "seven eight nine")]
+
+    def chunker(self, **config):
+        return Chunker({"TOKENIZER": None, **config})
+
+    def test_paragraphs_are_packed_whole(self):
+        chunks = list(self.chunker(CHUNK_TOKENS=6).chunks(self.PARAGRAPHS))
+        self.assertEqual(
+            chunks, [(1, "one two three\n\nfour five six"), (2, "seven eight nine")]
+        )
+
+    def test_long_paragraphs_are_split_under_the_cap(self):
+        paragraph = " ".join(f"w{i}" for i in range(10))
+        stats = ChunkStats()
+        chunker = self.chunker(CHUNK_TOKENS=3, MAX_TOKENS=4)
+        chunks = list(chunker.chunks([(3, paragraph)], stats))
+        self.assertEqual(
+            chunks, [(3, "w0 w1 w2"), (3, "w3 w4 w5"), (3, "w6 w7 w8"), (3, "w9")]
+        )
+        self.assertEqual((stats.chunks, stats.tokens, stats.longest), (4, 10, 3))
+
+    def test_sentence_window_overlap(self):
+        chunker = self.chunker(
+            STRATEGY="sentence-window", CHUNK_TOKENS=8, OVERLAP_TOKENS=4
+        )
+        self.assertEqual(
+            list(chunker.chunks([(1, "A b c. D e f. G h i.")])),
+            [(1, "A b c. D e f."), (1, "D e f. G h i.")],
+        )
+
+    def test_token_windows_keep_the_page_they_start_on(self):
+        chunker = self.chunker(
+            STRATEGY="token-budget", CHUNK_TOKENS=4, OVERLAP_TOKENS=1
+        )
+        self.assertEqual(
+            list(chunker.chunks(self.PARAGRAPHS)),
+            [
+                (1, "one two three\n\nfour"),
+                (1, "four five six\n\nseven"),
+                (2, "seven eight nine"),
+            ],
+        )
+
+    def test_empty_text_is_never_emitted(self):
+        for strategy in ("paragraph", "sentence-window", "token-budget"):
+            with self.subTest(strategy=strategy):
+                chunker = self.chunker(STRATEGY=strategy)
+                self.assertEqual(list(chunker.chunks([(1, ""), (2, "  \n ")])), [])
+
+    def test_invalid_config(self):
+        for config in (
+            {"STRATEGY": "semantic"},
+            {"CHUNK_TOKENS": 0},
+            {"MAX_TOKENS": 0},
+            {"OVERLAP_TOKENS": -1},
+        ):
+            with self.subTest(config=config):
+                with self.assertRaises(ValueError):
+                    self.chunker(**config)
+
+
+def numbered_pages(num_pages, lines=15, words_per_line=10):
+    """Pages of single-newline text whose words ("p3w12") name their page."""
+    return [
+        (
+            page,
+            "\n".join(
+                " ".join(
+                    f"p{page}w{word}"
+                    for word in range(
+                        line * words_per_line, (line + 1) * words_per_line
+                    )
+                )
+                for line in range(lines)
+            ),
+        )
+        for page in range(1, num_pages + 1)
+    ]
+
+
+class IterParagraphsTests(SimpleTestCase):
+    def setUp(self):
+        self.chunker = get_chunker(
+            {"TOKENIZER": None, "CHUNK_TOKENS": 60, "MAX_TOKENS": 80}
+        )
+
+    def test_pages_without_blank_lines_keep_their_page(self):
+        pages = numbered_pages(5)
+        chunks = list(self.chunker.chunks(iter_paragraphs(pages, self.chunker.fits)))
+        self.assertEqual({page for page, _ in chunks}, {1, 2, 3, 4, 5})
+        for page, chunk in chunks:
+            with self.subTest(chunk=chunk[:20]):
+                self.assertTrue(chunk.startswith(f"p{page}w"))
+
+    def test_no_piece_spans_more_than_a_page(self):
+        pieces = list(iter_paragraphs(numbered_pages(3), self.chunker.fits))
+        self.assertEqual([page for page, _ in pieces], [1, 2, 3])
+
+    def test_short_paragraph_over_a_page_break_stays_whole(self):
+        pages = [(1, "Intro.\n\nA short paragraph that"), (2, "goes on.\n\nNext.")]
+        self.assertEqual(
+            list(iter_paragraphs(pages, self.chunker.fits)),
+            [(1, "Intro."), (1, "A short paragraph that\ngoes on."), (2, "Next.")],
+        )
+        self.assertEqual(
+            list(iter_paragraphs(pages)),
+            [
+                (1, "Intro."),
+                (1, "A short paragraph that"),
+                (2, "goes on."),
+                (2, "Next."),
+            ],
+        )
+
+    def test_empty_pages_are_skipped(self):
+        pages = [(1, "One"), (2, ""), (3, "two\n\nthree")]
+        self.assertEqual(
+            list(iter_paragraphs(pages, self.chunker.fits)),
+            [(1, "One\ntwo"), (3, "three")],
+        )
+
+
+class FusionTests(SimpleTestCase):
+    def test_minmax_blends_with_weights(self):
+        fused = fuse_scores(
+            [0.2, 0.4, 0.6], [0.0, 5.0, 10.0], weights={"semantic": 0.25}
+        )
+        np.testing.assert_allclose(fused, [0.25, 0.375, 0.5])
+
+    def test_constant_signal_carries_no_weight(self):
+        fused = fuse_scores([0.3, 0.3], [1.0, 3.0])
+        np.testing.assert_allclose(fused, [0.0, 0.5])
+
+    def test_rrf_uses_ranks(self):
+        fused = fuse_scores([0.1, 0.9], [0.0, 100.0], method="rrf")
+        self.assertAlmostEqual(fused[0], fused[1])
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            fuse_scores([0.1], [1.0], method="max")
+
+    def test_parse_options(self):
+        method, weights = parse_fusion_options(
+            {"fusion": "rrf", "weights": {"lexical": "0.8"}}
+        )
+        self.assertEqual(method, "rrf")
+        self.assertEqual(weights, {"semantic": 0.5, "lexical": 0.8})
+
+    def test_invalid_weights(self):
+        for weights in (
+            [0.5],
+            {"title": 1.0},
+            {"semantic": "high"},
+            {"semantic": None},
+            {"semantic": -0.5},
+            {"semantic": float("nan")},
+            {"lexical": float("inf")},
+            {"lexical": "-Infinity"},
+        ):
+            with self.subTest(weights=weights):
+                with self.assertRaises(ValueError):
+                    parse_fusion_options({"weights": weights})
+
+
+class LocalLRUBackendTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LocalLRUBackend(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire_after_ttl(self):
+        cache = LocalLRUBackend(max_size=2, ttl=10)
+        with mock.patch("rag_app.cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1)
+        with mock.patch("rag_app.cache.time.monotonic", return_value=110.0):
+            self.assertEqual(cache.get("a"), 1)
+        with mock.patch("rag_app.cache.time.monotonic", return_value=110.5):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class ParseAskRequestTests(SimpleTestCase):
+    def test_defaults(self):
+        options = parse_ask_request({"q": "What is machine guarding?"})
+        self.assertEqual(options["k"], 5)
+        self.assertEqual(options["mode"], "baseline")
+        self.assertIsNone(options["nprobe"])
+
+    def test_integer_strings_are_accepted(self):
+        options = parse_ask_request({"q": "guarding", "k": "3", "nprobe": 8})
+        self.assertEqual((options["k"], options["nprobe"]), (3, 8))
+
+    def test_invalid_requests(self):
+        for data in (
+            [],
+            {},
+            {"q": ""},
+            {"q": "   "},
+            {"q": 123},
+            {"q": "guarding", "k": 0},
+            {"q": "guarding", "k": -3},
+            {"q": "guarding", "k": 2.5},
+            {"q": "guarding", "k": True},
+            {"q": "guarding", "k": "many"},
+            {"q": "guarding", "k": 10**6},
+            {"q": "guarding", "mode": "fast"},
+            {"q": "guarding", "ef_search": 0},
+            {"q": "guarding", "fusion": "max"},
+        ):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    parse_ask_request(data)
+
+
+class MergeCandidatesTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(resources, "bm25_index", BM25Index.build(CORPUS))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lexical_only_candidates_get_the_farthest_distance(self):
+        rows, distances, bm25_scores = merge_candidates(
+            "machine guarding",
+            np.array([0, 1]),
+            np.array([0.1, 0.7]),
+            np.array([2, 0]),
+            np.array([9.0, 8.0]),
+        )
+        self.assertEqual(rows.tolist(), [0, 1, 2])
+        np.testing.assert_allclose(distances, [0.1, 0.7, 0.7])
+        expected = reference_bm25(CORPUS, "machine guarding")
+        np.testing.assert_allclose(bm25_scores[:2], expected[[0, 1]], rtol=1e-5)
+        self.assertEqual(bm25_scores[2], 9.0)
+
+    def test_without_lexical_candidates(self):
+        rows, distances, _ = merge_candidates(
+            "machine",
+            np.array([3]),
+            np.array([0.5]),
+            np.array([], dtype=np.int64),
+            np.array([]),
+        )
+        self.assertEqual(rows.tolist(), [3])
+        self.assertEqual(distances.tolist(), [0.5])
+
+
+class PackContextsTests(TestCase):
+    CONFIG = {"TOKENIZER": None, "DEDUPE_THRESHOLD": 0.9, "MERGE_NEIGHBORS": True}
+
+    def setUp(self):
+        first = Document.objects.create(
+            title="First", file_path="first.pdf", source_url="http://first"
+        )
+        second = Document.objects.create(
+            title="Second", file_path="second.pdf", source_url="http://second"
+        )
+        # Every text is 4 tokens long but the last one (2 tokens)
+        chunks = [
+            (first, "alpha beta gamma delta", 1),
+            (first, "epsilon zeta eta theta", 2),
+            (second, "iota kappa lambda mu", 5),
+            (second, "iota kappa lambda mu", 9),
+            (second, "nu xi omicron pi", 12),
+            (second, "rho sigma", 20),
+        ]
+        ids = [
+            Chunk.objects.create(document=doc, chunk_text=text, chunk_order=order).id
+            for doc, text, order in chunks
+        ]
+        self.store = ChunkStore.from_database(ids)
+
+    def pack(self, rows, max_contexts=5, **config):
+        scores = np.linspace(1.0, 0.5, len(rows))
+        return pack_contexts(
+            self.store, rows, scores, "hybrid", max_contexts, {**self.CONFIG, **config}
+        )
+
+    def test_budget_is_inclusive(self):
+        contexts = self.pack([2, 4], TOKEN_BUDGET=8)
+        self.assertEqual(len(contexts), 2)
+        contexts = self.pack([2, 4], TOKEN_BUDGET=7)
+        self.assertEqual([c["text"] for c in contexts], ["iota kappa lambda mu"])
+
+    def test_chunks_that_do_not_fit_are_skipped(self):
+        contexts = self.pack([2, 0, 5], TOKEN_BUDGET=6)
+        self.assertEqual(
+            [c["text"] for c in contexts], ["iota kappa lambda mu", "rho sigma"]
+        )
+
+    def test_first_chunk_is_cut_to_the_budget(self):
+        contexts = self.pack([0, 2], TOKEN_BUDGET=2)
+        self.assertEqual([c["text"] for c in contexts], ["alpha beta"])
+
+    def test_near_duplicates_are_dropped(self):
+        contexts = self.pack([2, 3, 4], TOKEN_BUDGET=100)
+        self.assertEqual(
+            [c["text"] for c in contexts],
+            ["iota kappa lambda mu", "nu xi omicron pi"],
+        )
+
+    def test_max_contexts(self):
+        contexts = self.pack([2, 4, 0], max_contexts=2, TOKEN_BUDGET=100)
+        self.assertEqual(len(contexts), 2)
+
+    def test_neighbours_are_merged_at_the_best_rank(self):
+        contexts = self.pack([4, 1, 0], TOKEN_BUDGET=100)
+        self.assertEqual(
+            [c["text"] for c in contexts],
+            ["nu xi omicron pi", "alpha beta gamma delta\n\nepsilon zeta eta theta"],
+        )
+        self.assertEqual(contexts[1]["title"], "First")
+        self.assertEqual(contexts[1]["score"], 0.75)
+
+
+def fake_encode(texts):
+    """Two-dimensional embeddings derived from the text, to tell rows apart."""
+    return np.array([[len(text), ord(text[0])] for text in texts], dtype=np.float32)
+
+
+class EmbeddingStoreTests(SimpleTestCase):
+    MODEL = "test-model"
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = os.path.join(tmp.name, "store")
+
+    def embed(self, store, texts):
+        encode = mock.Mock(side_effect=fake_encode)
+        embeddings, encoded = store.embed(texts, content_hashes(texts), encode)
+        np.testing.assert_array_equal(embeddings, fake_encode(texts))
+        return encoded
+
+    def test_only_new_texts_are_encoded(self):
+        store = EmbeddingStore(self.directory, self.MODEL)
+        self.assertEqual(self.embed(store, ["alpha", "beta", "alpha"]), 2)
+        self.assertEqual(self.embed(store, ["beta", "gamma"]), 1)
+
+        reopened = EmbeddingStore(self.directory, self.MODEL)
+        self.assertEqual(len(reopened), 3)
+        self.assertEqual(self.embed(reopened, ["gamma", "alpha", "beta"]), 0)
+        self.assertEqual(
+            reopened.lookup(content_hashes(["alpha", "delta"])).tolist(), [0, -1]
+        )
+
+    def test_torn_append_is_ignored_and_overwritten(self):
+        store = EmbeddingStore(self.directory, self.MODEL)
+        self.embed(store, ["alpha", "beta"])
+        # An append interrupted after part of its vectors and hashes were written
+        with open(os.path.join(self.directory, VECTORS_FILE), "ab") as f:
+            f.write(b"\x01" * 4)
+        with open(os.path.join(self.directory, HASHES_FILE), "ab") as f:
+            f.write(content_hashes(["gamma"]).tobytes())
+
+        reopened = EmbeddingStore(self.directory, self.MODEL)
+        self.assertEqual(len(reopened), 2)
+        self.assertEqual(self.embed(reopened, ["gamma", "alpha"]), 1)
+        self.assertEqual(len(EmbeddingStore(self.directory, self.MODEL)), 3)
+        self.assertEqual(
+            os.path.getsize(os.path.join(self.directory, VECTORS_FILE)), 3 * 2 * 4
+        )
+
+    def test_other_model_is_rejected(self):
+        self.embed(EmbeddingStore(self.directory, self.MODEL), ["alpha"])
+        with self.assertRaises(ValueError):
+            EmbeddingStore(self.directory, "other-model")
+
+
+class ArtifactsTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+        self.document = Document.objects.create(
+            title="Guarding", file_path="guarding.pdf", source_url="http://guarding"
+        )
+        for order, text in enumerate(CORPUS[:4]):
+            Chunk.objects.create(
+                document=self.document,
+                chunk_text=text,
+                chunk_order=order,
+                page_number=order + 1,
+            )
+        ids = list(Chunk.objects.order_by("id").values_list("id", flat=True))
+        self.chunk_store = ChunkStore.from_database(ids)
+        self.bm25_index = BM25Index.build(CORPUS[:4])
+        write_artifacts(
+            self.directory,
+            self.chunk_store,
+            self.bm25_index,
+            current_corpus_version(),
+            extra={"index_kind": "flat"},
+        )
+
+    def rewrite_manifest(self, **changes):
+        manifest = {**read_manifest(self.directory), **changes}
+        with open(os.path.join(self.directory, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f)
+
+    def test_round_trip(self):
+        artifacts = load_artifacts(self.directory)
+        self.assertEqual(artifacts.num_rows, 4)
+        self.assertEqual(artifacts.manifest["index_kind"], "flat")
+        np.testing.assert_array_equal(artifacts.chunk_store.ids, self.chunk_store.ids)
+        rows = [3, 0, 2]
+        self.assertEqual(
+            artifacts.chunk_store.gather(rows, [0.9, 0.5, 0.1], "hybrid"),
+            self.chunk_store.gather(rows, [0.9, 0.5, 0.1], "hybrid"),
+        )
+        np.testing.assert_allclose(
+            artifacts.bm25_index.get_scores("machine guarding"),
+            self.bm25_index.get_scores("machine guarding"),
+        )
+
+    def test_a_new_import_makes_them_stale(self):
+        Chunk.objects.create(
+            document=self.document, chunk_text="Lockout tagout", chunk_order=4
+        )
+        with self.assertRaises(StaleArtifactsError):
+            load_artifacts(self.directory)
+
+    def test_a_relinked_document_makes_them_stale(self):
+        Document.objects.filter(pk=self.document.pk).update(source_url="http://new")
+        with self.assertRaises(StaleArtifactsError):
+            load_artifacts(self.directory)
+
+    def test_other_format_version_is_stale(self):
+        self.rewrite_manifest(format_version=ARTIFACT_FORMAT_VERSION - 1)
+        with self.assertRaises(StaleArtifactsError):
+            load_artifacts(self.directory)
+
+    def test_damaged_file_fails_its_checksum(self):
+        path = os.path.join(self.directory, "chunk_texts.npy")
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+        with self.assertRaises(StaleArtifactsError):
+            load_artifacts(self.directory)
+        # Checksums are optional, so only the size check runs here
+        load_artifacts(self.directory, verify_checksums=False)
+
+    def test_missing_artifacts(self):
+        with self.assertRaises(FileNotFoundError):
+            load_artifacts(os.path.join(self.directory, "missing"))
+
+
+def fake_sentence_transformer(encoded):
+    """A stand-in embedding model that records every text it encodes."""
+
+    def encode(texts, **kwargs):
+        encoded.extend(texts)
+        return np.array(
+            [
+                np.frombuffer(content_hashes([text])[0][:8], dtype=np.uint8)
+                for text in texts
+            ],
+            dtype=np.float32,
+        )
+
+    model = mock.Mock()
+    model.encode.side_effect = encode
+    model.get_sentence_embedding_dimension.return_value = 8
+    return model
+
+
+class IncrementalEmbedTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # embed_chunks writes to embeddings/ under the working directory
+        cwd = os.getcwd()
+        os.chdir(tmp.name)
+        self.addCleanup(os.chdir, cwd)
+
+        self.document = Document.objects.create(title="Guarding", file_path="g.pdf")
+        self.chunks = [
+            Chunk.objects.create(
+                document=self.document, chunk_text=text, chunk_order=order
+            )
+            for order, text in enumerate(CORPUS[:4])
+        ]
+        self.encoded = []
+        patcher = mock.patch(
+            "rag_app.management.commands.embed_chunks.SentenceTransformer",
+            return_value=fake_sentence_transformer(self.encoded),
+        )
+        self.model_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def embed(self):
+        self.encoded.clear()
+        output = StringIO()
+        call_command(
+            "embed_chunks",
+            "--no-embedding-store",
+            "--recall-queries=0",
+            stdout=output,
+        )
+        return output.getvalue()
+
+    def indexed_ids(self):
+        index = faiss.read_index(os.path.join("embeddings", "chunks.index"))
+        return sorted(faiss.vector_to_array(index.id_map).tolist())
+
+    def test_only_changed_chunks_are_encoded(self):
+        self.embed()
+        self.assertEqual(sorted(self.encoded), sorted(CORPUS[:4]))
+
+        edited, deleted = self.chunks[0], self.chunks[1]
+        edited.chunk_text = "Machine guarding, revised."
+        edited.save()
+        deleted.delete()
+        added = Chunk.objects.create(
+            document=self.document, chunk_text="Emergency stops.", chunk_order=4
+        )
+        output = self.embed()
+
+        self.assertEqual(
+            sorted(self.encoded), ["Emergency stops.", "Machine guarding, revised."]
+        )
+        self.assertIn("2 vectors added, 2 vectors removed, 4 vectors in total", output)
+        self.assertEqual(
+            self.indexed_ids(),
+            sorted([edited.id, self.chunks[2].id, self.chunks[3].id, added.id]),
+        )
+
+    def test_unchanged_corpus_does_not_load_the_model(self):
+        self.embed()
+        self.model_class.reset_mock()
+        with mock.patch(
+            "rag_app.management.commands.embed_chunks.invalidate_answer_cache"
+        ) as invalidate:
+            output = self.embed()
+        self.model_class.assert_not_called()
+        invalidate.assert_not_called()
+        self.assertIn("0 vectors added, 0 vectors removed", output)
+
+
+class PlanImportsTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.folder = tmp.name
+        patcher = mock.patch.object(import_pdfs, "BASE_FOLDER", self.folder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.command = import_pdfs.Command(stdout=StringIO())
+
+    def write_pdf(self, filename, content):
+        path = os.path.join(self.folder, filename)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def imported(self, path):
+        """A Document recording the file as it is on disk now."""
+        stat = os.stat(path)
+        return Document.objects.create(
+            title=os.path.basename(path),
+            file_path=path,
+            file_size=stat.st_size,
+            file_mtime=stat.st_mtime,
+            content_sha256=file_sha256(path),
+        )
+
+    def plan(self):
+        return self.command.plan_imports({}, purge=False)
+
+    def test_unchanged_files_are_skipped(self):
+        self.imported(self.write_pdf("a.pdf", b"first"))
+        touched = self.imported(self.write_pdf("b.pdf", b"second"))
+        os.utime(touched.file_path, (0, 0))
+
+        plans, counts = self.plan()
+        self.assertEqual(plans, {})
+        self.assertEqual(counts["unchanged"], 2)
+        touched.refresh_from_db()
+        self.assertEqual(touched.file_mtime, 0)
+
+    def test_changed_and_new_files_are_extracted(self):
+        changed = self.imported(self.write_pdf("a.pdf", b"first"))
+        self.write_pdf("a.pdf", b"first, edited")
+        new_path = self.write_pdf("c.pdf", b"third")
+
+        plans, counts = self.plan()
+        self.assertEqual((counts["changed"], counts["new"]), (1, 1))
+        self.assertEqual(plans[changed.file_path][1], changed)
+        fields, doc = plans[new_path]
+        self.assertIsNone(doc)
+        self.assertEqual(fields["content_sha256"], file_sha256(new_path))
+
+    def test_moved_file_is_relinked(self):
+        moved = self.imported(self.write_pdf("a.pdf", b"first"))
+        new_path = os.path.join(self.folder, "renamed.pdf")
+        os.rename(moved.file_path, new_path)
+
+        plans, counts = self.plan()
+        self.assertEqual(plans, {})
+        self.assertEqual(counts["relinked"], 1)
+        moved.refresh_from_db()
+        self.assertEqual(moved.file_path, new_path)
+        self.assertEqual(Document.objects.count(), 1)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.encoded = []
+        self.settings_seen = []
+
+    def encode_batch(self, queries):
+        self.encoded.append(list(queries))
+        return np.array([[float(len(query))] for query in queries])
+
+    def search_batch(self, matrix, k, search_settings):
+        self.settings_seen.append(search_settings)
+        # Row i finds ids 10 * length, 10 * length + 1, ...
+        ids = matrix.astype(np.int64) * 10 + np.arange(k)
+        return ids.astype(np.float32), ids
+
+    def batcher(self, **kwargs):
+        return MicroBatcher(self.encode_batch, self.search_batch, **kwargs)
+
+    def test_queries_in_one_window_share_a_batch(self):
+        batcher = self.batcher(max_wait_ms=200)
+        futures = [
+            batcher.submit("a", 1),
+            batcher.submit("bb", 3, {"nprobe": 4}),
+            batcher.submit("ccc", 2),
+        ]
+        results = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(self.encoded, [["a", "bb", "ccc"]])
+        self.assertEqual(self.settings_seen, [[None, {"nprobe": 4}, None]])
+        self.assertEqual(
+            [ids.tolist() for _, ids in results], [[[10]], [[20, 21, 22]], [[30, 31]]]
+        )
+        stats = batcher.stats()
+        self.assertEqual((stats["batches"], stats["requests"]), (1, 3))
+        self.assertEqual(stats["batch_size_histogram"], {"3": 1})
+
+    def test_batches_are_capped(self):
+        batcher = self.batcher(max_batch_size=2, max_wait_ms=200)
+        futures = [batcher.submit(query, 1) for query in ("a", "bb", "ccc")]
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(self.encoded, [["a", "bb"], ["ccc"]])
+
+    def test_errors_reach_every_caller(self):
+        batcher = MicroBatcher(
+            mock.Mock(side_effect=RuntimeError("encoder failed")),
+            self.search_batch,
+            max_wait_ms=200,
+        )
+        futures = [batcher.submit(query, 1) for query in ("a", "bb")]
+        for future in futures:
+            with self.assertRaisesMessage(RuntimeError, "encoder failed"):
+                future.result(timeout=5)
+        # The worker keeps serving after a failed batch
+        batcher.encode_batch = self.encode_batch
+        self.assertEqual(batcher.search("a", 1)[1].tolist(), [[10]])
@@ -3,4 +3,9 @@ from . import views
 
 urlpatterns = [
     path("ask", views.ask_question, name="ask_question"),
+    path("ask/batch", views.ask_batch, name="ask_batch"),
+    path("ask/async", views.ask_question_async, name="ask_question_async"),
+    path("ask/stream", views.ask_question_stream, name="ask_question_stream"),
+    path("ready", views.readiness, name="readiness"),
+    path("metrics", views.metrics, name="metrics"),
 ]
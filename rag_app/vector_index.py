@@ -0,0 +1,160 @@
+import hashlib
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+# Named index presets accepted by `embed_chunks --index-spec`; anything else is
+# passed to faiss.index_factory as-is (e.g. "IVF1024,PQ48" or "HNSW32,Flat").
+INDEX_PRESETS = ("flat", "ivfflat", "ivfpq", "hnsw")
+# Neighbours per node of an "hnsw" preset index when --hnsw-m is not given
+DEFAULT_HNSW_M = 32
+# Search-time defaults for approximate indexes, overridden by RAG_FAISS_SEARCH:
+# inverted lists probed (IVF) and candidate list size (HNSW)
+DEFAULT_SEARCH_CONFIG = {"NPROBE": 16, "EF_SEARCH": 64}
+
+# Sidecar describing what the index holds: one (Chunk.id, SHA-1 of chunk text)
+# record per vector, so `embed_chunks` can tell which chunks need re-encoding.
+EMBEDDED_CHUNKS_DTYPE = np.dtype([("chunk_id", "<i8"), ("content_hash", "S20")])
+
+
+def default_nlist(num_vectors):
+    """About 4 * sqrt(n) inverted lists, keeping >= 39 training points per centroid."""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+
+def factory_string(spec, num_vectors, dimension, nlist=None, pq_m=None, hnsw_m=None):
+    """Turns an --index-spec value into a faiss.index_factory description."""
+    preset = spec.lower()
+    if preset not in INDEX_PRESETS:
+        return spec
+
+    if preset == "flat":
+        return "Flat"
+    if preset == "hnsw":
+        return f"HNSW{hnsw_m or DEFAULT_HNSW_M}"
+
+    nlist = nlist or default_nlist(num_vectors)
+    if preset == "ivfflat":
+        return f"IVF{nlist},Flat"
+
+    # PQ needs the dimension to split evenly into sub-quantizers
+    pq_m = pq_m or next(m for m in (48, 32, 24, 16, 8, 4, 2, 1) if dimension % m == 0)
+    return f"IVF{nlist},PQ{pq_m}"
+
+
+def content_hashes(texts):
+    """SHA-1 digest of each text, as a fixed-width bytes array."""
+    return np.array(
+        [hashlib.sha1(text.encode("utf-8")).digest() for text in texts], dtype="S20"
+    )
+
+
+def build_index(embeddings, ids, factory, train_size=50000, held_out_rows=(), seed=0):
+    """
+    Creates an IndexIDMap keyed by `ids`, trains it when needed, and adds every vector.
+
+    Training uses a random sample of at most train_size vectors, leaving out
+    held_out_rows so they can serve as unseen queries for recall_at_k.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = faiss.index_factory(embeddings.shape[1], factory, faiss.METRIC_L2)
+    if not index.is_trained:
+        candidates = np.setdiff1d(np.arange(len(embeddings)), held_out_rows)
+        if len(candidates) == 0:
+            candidates = np.arange(len(embeddings))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(candidates), train_size)
+        index.train(embeddings[rng.choice(candidates, sample_size, replace=False)])
+    # Keyed by Chunk.id, so vectors of deleted chunks can be removed later
+    index = faiss.IndexIDMap(index)
+    index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def write_index(index, path):
+    """Writes the index next to `path` and renames it into place in one step."""
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_embedded_chunks(path):
+    """Returns the (chunk_id, content_hash) records saved with the index, or None."""
+    try:
+        return np.load(path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_embedded_chunks(path, chunk_ids, hashes):
+    records = np.empty(len(chunk_ids), dtype=EMBEDDED_CHUNKS_DTYPE)
+    records["chunk_id"] = chunk_ids
+    records["content_hash"] = hashes
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, records)
+    os.replace(tmp_path, path)
+
+
+def is_keyed_by_id(index):
+    """True when search results are Chunk ids rather than insertion positions."""
+    return isinstance(
+        faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2)
+    )
+
+
+def describe_index(index):
+    """Returns the index family ("ivf", "hnsw" or "flat") behind any IDMap wrapper."""
+    try:
+        faiss.extract_index_ivf(index)
+        return "ivf"
+    except RuntimeError:
+        pass
+    inner = faiss.downcast_index(index)
+    if is_keyed_by_id(inner):
+        inner = faiss.downcast_index(inner.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def search_parameters(index, nprobe=None, ef_search=None):
+    """
+    Builds per-call FAISS search parameters for the index type.
+
+    Per-call parameters leave the shared index untouched, so concurrent
+    requests can use different settings safely. Returns None for flat indexes.
+    """
+    family = describe_index(index)
+    if family == "ivf" and nprobe:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+    if family == "hnsw" and ef_search:
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
+
+
+def recall_at_k(index, reference_index, queries, k, params=None):
+    """
+    Compares an approximate index with an exact one on the same queries.
+
+    Returns the mean fraction of the exact top-k that the index also returns, and
+    the mean search latency per query of both, in milliseconds.
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+
+    started = time.perf_counter()
+    _, exact_ids = reference_index.search(queries, k)
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    started = time.perf_counter()
+    _, approx_ids = index.search(queries, k, params=params)
+    approx_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    hits = [
+        len(set(exact[exact >= 0]) & set(approx[approx >= 0])) / k
+        for exact, approx in zip(exact_ids, approx_ids)
+    ]
+    return float(np.mean(hits)), exact_ms, approx_ms
@@ -1,251 +1,382 @@
+import asyncio
 import json
-import os
-import faiss
-from django.http import JsonResponse, HttpResponseBadRequest
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.views.decorators.csrf import csrf_exempt
-from sentence_transformers import SentenceTransformer
-import numpy as np
-from rank_bm25 import BM25Okapi
-from rag_app.models import Chunk, Document
+from rag_app import resources
+from rag_app.instrumentation import (
+    OLLAMA_ERRORS,
+    current_timings_ms,
+    instrument_view,
+    render_metrics,
+)
+from rag_app.llm import (
+    GENERATION_ERROR_ANSWERS,
+    agenerate_answer,
+    build_citations,
+    finalize_answer,
+    stream_answer,
+)
+from rag_app.pipeline import (
+    answer_from_contexts,
+    aretrieve_contexts,
+    cached_answer,
+    parse_ask_request,
+    retrieve_contexts,
+    retrieve_contexts_batch,
+    run_in_search_executor,
+    store_answer,
+)
 import requests
 
-# Define the paths for the generated files (must match embed_chunks.py)
-EMBEDDINGS_DIR = "embeddings"
-INDEX_FILE = os.path.join(EMBEDDINGS_DIR, "chunks.index")
-MAPPING_FILE = os.path.join(EMBEDDINGS_DIR, "chunk_id_map.json")
+# Add per-stage timings to /ask responses; on by default while debugging
+_response_timings = getattr(settings, "RAG_METRICS", {}).get(
+    "RESPONSE_TIMINGS", settings.DEBUG
+)
 
-# Global variables for all search resources
-model = None
-faiss_index = None
-chunk_id_map = None
-bm25_index = None
-bm25_id_map = None
-chunk_objects = None
 
+def _timings_block():
+    """The optional "timings" field of a response, in milliseconds per stage."""
+    return {"timings": current_timings_ms()} if _response_timings else {}
 
-def load_resources():
-    """Loads all search resources (model, FAISS index, ID map, and BM25 index)."""
-    global model, faiss_index, chunk_id_map, bm25_index, bm25_id_map, chunk_objects
 
-    # Check if resources are already loaded
-    if model and faiss_index and bm25_index:
-        return True, ""
+@csrf_exempt
+@instrument_view("ask")
+def ask_question(request):
+    """
+    Handles a user question and performs either a baseline or reranked search.
+    """
+    if request.method != "POST":
+        return HttpResponseBadRequest("Only POST requests are allowed.")
 
-    # Load Sentence Transformer model
-    if model is None:
-        try:
-            model = SentenceTransformer("all-MiniLM-L6-v2")
-            print("Sentence Transformer model loaded.")
-        except Exception as e:
-            return False, f"Failed to load Sentence Transformer model: {e}"
-
-    # Load FAISS index and ID map
-    if faiss_index is None:
-        if not os.path.exists(INDEX_FILE) or not os.path.exists(MAPPING_FILE):
-            return (
-                False,
-                "Embeddings not found. Please run `python manage.py embed_chunks` first.",
-            )
-        try:
-            faiss_index = faiss.read_index(INDEX_FILE)
-            print("FAISS index loaded.")
-            with open(MAPPING_FILE, "r") as f:
-                chunk_id_map = json.load(f)
-            print("Chunk ID mapping loaded.")
-        except Exception as e:
-            return False, f"Failed to load FAISS index or map: {e}"
-
-    # Load all chunks for BM25 indexing
-    if bm25_index is None:
+    success, error_msg = resources.load_resources()
+    if not success:
+        return JsonResponse({"error": error_msg}, status=500)
+
+    try:
+        data = json.loads(request.body)
         try:
-            chunk_objects = list(Chunk.objects.all().order_by("id"))
-            if not chunk_objects:
-                return (
-                    False,
-                    "No chunks found in the database. Please run `import_pdfs` first.",
-                )
-            tokenized_corpus = [doc.chunk_text.split(" ") for doc in chunk_objects]
-            bm25_index = BM25Okapi(tokenized_corpus)
-            bm25_id_map = {chunk.id: i for i, chunk in enumerate(chunk_objects)}
-            print("BM25 index and ID map created.")
-        except Exception as e:
-            return False, f"Failed to create BM25 index: {e}"
-
-    return True, ""
-
-
-def generate_answer(query, contexts):
-    """Generates a concise, cited answer using a local Ollama LLM and the provided contexts."""
-
-    context_text = "\n\n".join(
-        [f"({i + 1}) {c['text']}" for i, c in enumerate(contexts)]
-    )
+            options = parse_ask_request(data)
+        except (TypeError, ValueError) as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Serve repeated questions straight from the answer cache, skipping
+        # retrieval and generation entirely
+        cache_key, cached_response = cached_answer(options)
+        if cached_response is not None:
+            return JsonResponse({**cached_response, "cached": True, **_timings_block()})
 
-    prompt = f"""
-Use the following pieces of context to answer the question. If the answer is not in the provided context, politely state that you cannot answer from the given information. Provide a short, concise answer and always include the citation number(s) from the context.
-Context:
-{context_text}
-Question:
-{query}
-"""
+        contexts_to_return, reranker_used_label = retrieve_contexts(options)
+
+        # Step 5: Generate the real answer using the LLM
+        response_data = answer_from_contexts(
+            options, contexts_to_return, reranker_used_label, cache_key
+        )
+        return JsonResponse({**response_data, "cached": False, **_timings_block()})
+
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest("Invalid JSON in request body.")
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@instrument_view("ask_async")
+async def ask_question_async(request):
+    """
+    Async version of /ask for ASGI servers.
+
+    Search runs in a bounded thread pool and generation uses a pooled async
+    HTTP client, so one worker can hold many questions in flight. When the
+    client disconnects, the view is cancelled and the Ollama request is closed.
+    """
+    if request.method != "POST":
+        return HttpResponseBadRequest("Only POST requests are allowed.")
+
+    success, error_msg = await run_in_search_executor(resources.load_resources)
+    if not success:
+        return JsonResponse({"error": error_msg}, status=500)
 
     try:
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
-                "model": "tinyllama",
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,
-                    "num_ctx": 2048,  # Increase context window for better performance
-                },
-            },
+        data = json.loads(request.body)
+        try:
+            options = parse_ask_request(data)
+        except (TypeError, ValueError) as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # The answer cache may be a database or network backend, so it is
+        # read and written off the event loop
+        cache_key, cached_response = await run_in_search_executor(
+            cached_answer, options
         )
-        response.raise_for_status()
-
-        full_response = json.loads(response.text)
-        answer = full_response["response"].strip()
-
-        # Add a simple check for "I cannot answer" based on the prompt
-        if (
-            "cannot answer" in answer.lower()
-            or "i am unable to answer" in answer.lower()
-        ):
-            return (
-                "I am unable to answer this question from the provided documents.",
-                [],
-            )
+        if cached_response is not None:
+            return JsonResponse({**cached_response, "cached": True, **_timings_block()})
 
-        # Find the citations and add them
-        citations = []
-        for c in contexts:
-            if c["title"] not in [cite["title"] for cite in citations]:
-                citations.append({"title": c["title"], "link": c["link"]})
+        contexts_to_return, reranker_used_label = await aretrieve_contexts(options)
+        answer, citations = await agenerate_answer(options["query"], contexts_to_return)
 
-        return answer, citations
+        response_data = {
+            "answer": answer,
+            "contexts": contexts_to_return,
+            "citations": citations,
+            "reranker_used": reranker_used_label,
+        }
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error communicating with Ollama: {e}")
-        return "An error occurred during answer generation. Is Ollama running?", []
+        if answer not in GENERATION_ERROR_ANSWERS:
+            await run_in_search_executor(store_answer, cache_key, response_data)
 
+        return JsonResponse({**response_data, "cached": False, **_timings_block()})
+
+    except asyncio.CancelledError:
+        print("Client disconnected; cancelled the in-flight question.")
+        raise
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest("Invalid JSON in request body.")
     except Exception as e:
-        print(f"Error during LLM generation: {e}")
-        return "An error occurred during answer generation.", []
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+def _parse_batch_request(data):
+    """Reads the /ask/batch body: a list of questions, or an object with options."""
+    if isinstance(data, list):
+        data = {"questions": data}
+    if not isinstance(data, dict) or not isinstance(data.get("questions"), list):
+        raise ValueError("Provide 'questions' as a list of {q, k, mode} objects.")
+
+    max_questions = getattr(settings, "RAG_BATCH_MAX_QUESTIONS", 1000)
+    if len(data["questions"]) > max_questions:
+        raise ValueError(f"At most {max_questions} questions are allowed per batch.")
+
+    max_parallel = getattr(settings, "RAG_BATCH_MAX_PARALLEL_GENERATIONS", 4)
+    parallel = int(data.get("parallel", max_parallel))
+    return {
+        "questions": data["questions"],
+        "generate": bool(data.get("generate", True)),
+        "parallel": max(1, min(parallel, max_parallel)),
+        "format": data.get("format", "json"),
+    }
+
+
+def _answer_batch(batch):
+    """
+    Yields (index, result) for every question of a batch as soon as it is ready.
+
+    Cached answers and invalid questions come first. The remaining questions are
+    retrieved together, then generated with bounded parallelism.
+    """
+    pending = []
+    for index, item in enumerate(batch["questions"]):
+        if not isinstance(item, dict):
+            yield index, {"error": "Each question must be an object with 'q'."}
+            continue
+        try:
+            options = parse_ask_request(item)
+        except (TypeError, ValueError) as e:
+            yield index, {"error": str(e)}
+            continue
+        cache_key, cached_response = cached_answer(options)
+        if cached_response is not None:
+            yield index, {**cached_response, "cached": True}
+        else:
+            pending.append((index, options, cache_key))
+
+    retrieved = retrieve_contexts_batch([options for _, options, _ in pending])
+
+    if not batch["generate"]:
+        for (index, _, _), (contexts, label) in zip(pending, retrieved):
+            yield index, {"contexts": contexts, "reranker_used": label}
+        return
+
+    with ThreadPoolExecutor(
+        max_workers=batch["parallel"], thread_name_prefix="rag-batch"
+    ) as pool:
+        futures = {
+            pool.submit(
+                answer_from_contexts, options, contexts, label, cache_key
+            ): index
+            for (index, options, cache_key), (contexts, label) in zip(
+                pending, retrieved
+            )
+        }
+        for future in as_completed(futures):
+            yield futures[future], {**future.result(), "cached": False}
 
 
 @csrf_exempt
-def ask_question(request):
+@instrument_view("ask_batch")
+def ask_batch(request):
     """
-    Handles a user question and performs either a baseline or reranked search.
+    Answers many questions in one call.
+
+    The body is a list of /ask bodies, or {"questions": [...], "generate": bool,
+    "parallel": int, "format": "json" | "ndjson"}. With "ndjson" each result is
+    streamed on its own line as soon as it finishes, tagged with its "index".
     """
     if request.method != "POST":
         return HttpResponseBadRequest("Only POST requests are allowed.")
 
-    success, error_msg = load_resources()
+    success, error_msg = resources.load_resources()
     if not success:
         return JsonResponse({"error": error_msg}, status=500)
 
     try:
         data = json.loads(request.body)
-        query = data.get("q", "")
-        k = int(data.get("k", 5))
-        mode = data.get("mode", "baseline")
-
-        if not query:
-            return JsonResponse({"error": "Query 'q' is required."}, status=400)
-
-        # Step 1: Perform baseline FAISS search
-        query_embedding = model.encode([query], convert_to_numpy=True)
-        distances, faiss_ids = faiss_index.search(
-            query_embedding, k=k * 2
-        )  # Retrieve more for reranking
-
-        # Step 2: Retrieve the full chunk objects and their scores
-        initial_contexts = []
-        for i, faiss_id in enumerate(faiss_ids[0]):
-            chunk_db_id = chunk_id_map.get(str(faiss_id))
-            if chunk_db_id is not None:
-                chunk = next((c for c in chunk_objects if c.id == chunk_db_id), None)
-                if chunk:
-                    initial_contexts.append(
-                        {
-                            "id": chunk.id,
-                            "text": chunk.chunk_text,
-                            "semantic_score": float(distances[0][i]),
-                            "document": chunk.document,
-                            "reranker_used": mode,
-                        }
-                    )
-
-        # Check if the user wants to use the reranker
-        if mode == "reranker":
-            # Step 3: Perform BM25 keyword search
-            tokenized_query = query.split(" ")
-            bm25_scores = bm25_index.get_scores(tokenized_query)
-
-            # Step 4: Blend semantic and keyword scores
-            reranked_contexts = []
-            for context in initial_contexts:
-                # Find the BM25 score for the chunk using our new map
-                bm25_index_id = bm25_id_map.get(context["id"])
-                if bm25_index_id is not None:
-                    bm25_score = bm25_scores[bm25_index_id]
-
-                    # Simple blending: sum of normalized scores
-                    # Note: You may need to tune this blending later, but this is a solid start.
-                    blended_score = context["semantic_score"] + bm25_score
-
-                    reranked_contexts.append(
-                        {
-                            "text": context["text"],
-                            "score": blended_score,
-                            "link": context["document"].source_url,
-                            "title": context["document"].title,
-                            "reranker_used": "hybrid",
-                        }
-                    )
-
-            # Sort by the new blended score
-            reranked_contexts.sort(key=lambda x: x["score"], reverse=True)
-            # IMPORTANT: Pass only the top 2 chunks to the LLM to prevent context overflow
-            contexts_to_return = reranked_contexts[:2]
-            reranker_used_label = "hybrid"
-
-        elif mode == "baseline":
-            # Baseline mode: just format the initial contexts
-            # IMPORTANT: Pass only the top 2 chunks to the LLM to prevent context overflow
-            contexts_to_return = [
-                {
-                    "text": c["text"],
-                    "score": c["semantic_score"],
-                    "link": c["document"].source_url,
-                    "title": c["document"].title,
-                    "reranker_used": "baseline",
-                }
-                for c in initial_contexts[:2]
-            ]
-            reranker_used_label = "baseline"
-
-        else:
-            return JsonResponse(
-                {"error": "Invalid mode. Use 'baseline' or 'reranker'."}, status=400
+        try:
+            batch = _parse_batch_request(data)
+        except (TypeError, ValueError) as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        if batch["format"] == "ndjson":
+            lines = (
+                json.dumps({"index": index, **result}) + "\n"
+                for index, result in _answer_batch(batch)
             )
+            return StreamingHttpResponse(lines, content_type="application/x-ndjson")
 
-        # Step 5: Generate the real answer using the LLM
-        answer, citations = generate_answer(query, contexts_to_return)
+        results = [None] * len(batch["questions"])
+        for index, result in _answer_batch(batch):
+            results[index] = result
+        return JsonResponse(results, safe=False)
 
-        # Build the final response
-        response_data = {
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest("Invalid JSON in request body.")
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+def _sse_event(event, data):
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _answer_events(options, contexts, reranker_used_label, cache_key):
+    """Yields the contexts first, then each LLM token, then the final answer."""
+    yield _sse_event(
+        "contexts",
+        {
+            "contexts": contexts,
+            "citations": build_citations(contexts),
+            "reranker_used": reranker_used_label,
+        },
+    )
+
+    tokens = []
+    try:
+        for token in stream_answer(options["query"], contexts):
+            tokens.append(token)
+            yield _sse_event("token", {"token": token})
+    except requests.exceptions.RequestException as e:
+        print(f"Error communicating with Ollama: {e}")
+        OLLAMA_ERRORS.inc(kind="connection")
+        yield _sse_event("error", {"error": GENERATION_ERROR_ANSWERS[0]})
+        return
+    except Exception as e:
+        print(f"Error during LLM generation: {e}")
+        OLLAMA_ERRORS.inc(kind="other")
+        yield _sse_event("error", {"error": GENERATION_ERROR_ANSWERS[1]})
+        return
+
+    answer, citations = finalize_answer("".join(tokens), contexts)
+    store_answer(
+        cache_key,
+        {
             "answer": answer,
-            "contexts": contexts_to_return,
+            "contexts": contexts,
             "citations": citations,
             "reranker_used": reranker_used_label,
-        }
+        },
+    )
+    yield _sse_event(
+        "done", {"answer": answer, "citations": citations, "cached": False}
+    )
+
+
+def _cached_answer_events(cached_response):
+    """Replays a cached answer with the same event sequence as a live one."""
+    yield _sse_event(
+        "contexts",
+        {
+            "contexts": cached_response["contexts"],
+            "citations": build_citations(cached_response["contexts"]),
+            "reranker_used": cached_response["reranker_used"],
+        },
+    )
+    yield _sse_event("token", {"token": cached_response["answer"]})
+    yield _sse_event(
+        "done",
+        {
+            "answer": cached_response["answer"],
+            "citations": cached_response["citations"],
+            "cached": True,
+        },
+    )
 
-        return JsonResponse(response_data)
+
+@csrf_exempt
+@instrument_view("ask_stream")
+def ask_question_stream(request):
+    """
+    Same request body as /ask, answered as Server-Sent Events.
+
+    The retrieved contexts are sent as soon as the search finishes, then the
+    answer is relayed token by token while Ollama generates it.
+    """
+    if request.method != "POST":
+        return HttpResponseBadRequest("Only POST requests are allowed.")
+
+    success, error_msg = resources.load_resources()
+    if not success:
+        return JsonResponse({"error": error_msg}, status=500)
+
+    try:
+        data = json.loads(request.body)
+        try:
+            options = parse_ask_request(data)
+        except (TypeError, ValueError) as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        cache_key, cached_response = cached_answer(options)
+        if cached_response is not None:
+            events = _cached_answer_events(cached_response)
+        else:
+            contexts, reranker_used_label = retrieve_contexts(options)
+            events = _answer_events(options, contexts, reranker_used_label, cache_key)
 
     except json.JSONDecodeError:
         return HttpResponseBadRequest("Invalid JSON in request body.")
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
+
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop reverse proxies such as nginx from buffering the event stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def readiness(request):
+    """Reports resource load state and timings, plus cache and batching stats."""
+    ready = resources.is_ready()
+    return JsonResponse(
+        {
+            "ready": ready,
+            "resources": resources.load_status,
+            "caches": resources.cache_stats(),
+            "micro_batching": resources.batching_stats(),
+            "cross_encoder": resources.cross_encoder_stats(),
+        },
+        status=200 if ready else 503,
+    )
+
+
+def metrics(request):
+    """Request, stage, cache and generation metrics in the Prometheus text format."""
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rag_project.settings")
+# Lets rag_app warm up its search resources in this process, see rag_app.apps
+os.environ.setdefault("RAG_SERVER_PROCESS", "1")
 
 application = get_asgi_application()
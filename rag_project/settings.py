@@ -121,3 +121,136 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# RAG service
+
+# Verify the SHA-256 checksums of the search artifacts written by embed_chunks
+# when a worker maps them. Sizes and the corpus version are always checked.
+RAG_VERIFY_ARTIFACT_CHECKSUMS = True
+
+# Load the model, FAISS index and lexical index in a background thread when a
+# server process starts, instead of on the first /ask request.
+RAG_EAGER_WARMUP = True
+
+# Cache of query embeddings keyed on the normalized query and the model name.
+# BACKEND "local" is a per-process LRU bounded by MAX_SIZE; "django" uses the
+# Django cache named by CACHE_ALIAS so that workers share entries. TTL is in
+# seconds (None keeps entries until they are evicted).
+RAG_QUERY_EMBEDDING_CACHE = {
+    "ENABLED": True,
+    "BACKEND": "local",
+    "MAX_SIZE": 1024,
+    "TTL": None,
+    "CACHE_ALIAS": "default",
+}
+
+# Cache of complete /ask responses. Keys include the query, k, mode, fusion
+# options, the prompt version and the corpus version; import_pdfs and
+# embed_chunks invalidate it. Same BACKEND options as above.
+RAG_ANSWER_CACHE = {
+    "ENABLED": True,
+    "BACKEND": "local",
+    "MAX_SIZE": 256,
+    "TTL": 24 * 60 * 60,
+    "CACHE_ALIAS": "default",
+}
+
+# Connection pooling and timeouts (seconds) for requests to Ollama
+RAG_OLLAMA = {
+    "CONNECT_TIMEOUT": 5.0,
+    "READ_TIMEOUT": 120.0,
+    "MAX_CONNECTIONS": 16,
+}
+
+# Threads running encode/FAISS/BM25 for the async /ask/async endpoint
+RAG_SEARCH_EXECUTOR_WORKERS = 4
+
+# Coalesce the query encodes and FAISS searches of concurrent requests: the
+# first query waits up to MAX_WAIT_MS for others, and up to MAX_BATCH_SIZE
+# queries are encoded and searched together. Batch sizes and queueing delays
+# are reported by /ready.
+RAG_MICRO_BATCHING = {
+    "ENABLED": False,
+    "MAX_BATCH_SIZE": 32,
+    "MAX_WAIT_MS": 5,
+}
+
+# Largest "k" (contexts per answer) a request may ask for
+RAG_MAX_K = 50
+
+# Limits for /ask/batch: questions per call, and answers generated at once
+RAG_BATCH_MAX_QUESTIONS = 1000
+RAG_BATCH_MAX_PARALLEL_GENERATIONS = 4
+
+# Query-time search settings for approximate FAISS indexes built with
+# `embed_chunks --index-spec`: inverted lists probed (IVF) and candidate list
+# size (HNSW). Higher is more accurate and slower; requests may override both
+# with "nprobe" and "ef_search". Flat indexes ignore them.
+RAG_FAISS_SEARCH = {
+    "NPROBE": 16,
+    "EF_SEARCH": 64,
+}
+
+# Content-addressed store of chunk embeddings used by `embed_chunks`, so text
+# that was embedded before (e.g. after `import_pdfs --purge-and-reimport`) is
+# not encoded again. float16 halves its size on disk.
+RAG_EMBEDDING_STORE = {
+    "ENABLED": True,
+    "DTYPE": "float32",
+}
+
+# How `import_pdfs` splits documents into chunks (see rag_app/chunking.py).
+# Sizes are in tokens of the embedding model's tokenizer; MAX_TOKENS keeps every
+# chunk inside the 256-token window of all-MiniLM-L6-v2. Command-line options
+# override these values.
+RAG_CHUNKING = {
+    "STRATEGY": "paragraph",
+    "CHUNK_TOKENS": 200,
+    "OVERLAP_TOKENS": 0,
+    "MAX_TOKENS": 254,
+    "TOKENIZER": "sentence-transformers/all-MiniLM-L6-v2",
+}
+
+# First-stage retrieval for the "reranker" and "cross" modes. The dense (FAISS)
+# top DENSE_DEPTH and the BM25 top LEXICAL_DEPTH are searched concurrently and
+# merged into one candidate pool before fusion. DENSE_DEPTH 0 means k * 2;
+# LEXICAL_DEPTH 0 reranks the dense candidates only. THREADS bounds the BM25 pool.
+RAG_HYBRID_RETRIEVAL = {
+    "DENSE_DEPTH": 0,
+    "LEXICAL_DEPTH": 20,
+    "THREADS": 4,
+}
+
+# Second-stage reranking for mode "cross". A cross-encoder rescores the top
+# CANDIDATES hybrid candidates in one batch, with each (query, chunk) pair
+# truncated to MAX_LENGTH tokens. If scoring takes longer than
+# LATENCY_BUDGET_MS, or the model is still loading, the hybrid ranking is used
+# instead. Pair scores are kept in an LRU of CACHE_SIZE entries (0 disables it).
+RAG_CROSS_ENCODER = {
+    "ENABLED": True,
+    "MODEL": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+    "CANDIDATES": 20,
+    "MAX_LENGTH": 256,
+    "BATCH_SIZE": 32,
+    "LATENCY_BUDGET_MS": 1000,
+    "CACHE_SIZE": 10000,
+}
+
+# How ranked chunks are packed into the TinyLlama prompt (num_ctx 2048). Up to
+# k chunks are added best first while they fit in TOKEN_BUDGET tokens, counted
+# with TOKENIZER (a Hugging Face tokenizer name, or None for a fast word-based
+# approximation). Near-duplicates are skipped and chunks that are neighbours in
+# the same document are merged into one context.
+RAG_CONTEXT_PACKING = {
+    "TOKEN_BUDGET": 1000,
+    "TOKENIZER": None,
+    "DEDUPE_THRESHOLD": 0.9,
+    "MERGE_NEIGHBORS": True,
+}
+
+# Request metrics exported on /metrics. RESPONSE_TIMINGS adds a "timings" block
+# (milliseconds per stage) to /ask and /ask/async responses; it defaults to DEBUG.
+RAG_METRICS = {
+    "RESPONSE_TIMINGS": DEBUG,
+}